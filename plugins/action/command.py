@@ -9,6 +9,8 @@ __metaclass__ = type
 import os
 import time
 
+from ansible.module_utils._text import to_text
+from ansible.module_utils.connection import Connection, ConnectionError as AnsibleConnectionError
 from ansible.module_utils.six import string_types
 from ansible.plugins.action.normal import ActionModule as _ActionModule
 
@@ -24,6 +26,10 @@ except ImportError:
   display = Display()
 
 
+# persistent connection plugin in this collection
+PERSISTENT_CONNECTION = 'iida.telnet.telnet'
+
+
 class ActionModule(_ActionModule):
 
   @staticmethod
@@ -54,6 +60,90 @@ class ActionModule(_ActionModule):
     return filename
 
 
+  def fetch_logs(self, result, log_path):
+    """fetch the log files written by the module on the delegated host"""
+    remote_paths = result.get('log_files') or [result.get('log_path')]
+    local_dir = os.path.join(self.get_working_path(), os.path.dirname(log_path))
+    if not os.path.exists(local_dir):
+      os.makedirs(local_dir)
+
+    local_paths = list()
+    for remote_path in remote_paths:
+      local_path = os.path.join(local_dir, os.path.basename(remote_path))
+      self._connection.fetch_file(remote_path, local_path)
+      local_paths.append(local_path)
+
+    result['log_path'] = local_paths[0]
+    if result.get('log_files'):
+      result['log_files'] = local_paths
+
+
+  def remove_log_tmpdir(self, result):
+    """remove the temporary directory the module made for the log on the delegated host"""
+    tmpdir = result.pop('log_tmpdir', None)
+    # only the directory made by tempfile.mkdtemp() of the module
+    if tmpdir and os.path.isabs(tmpdir) and os.path.basename(tmpdir).startswith('iida_telnet_'):
+      self._low_level_execute_command(self._connection._shell.remove(tmpdir, recurse=True), sudoable=False)
+
+
+  @staticmethod
+  def host_params(hostvars):
+    """telnet params of the host from inventory variables"""
+    return {
+      'host': hostvars.get('remote_addr') or hostvars.get('ansible_ssh_host') or hostvars.get('ansible_host'),
+      'port': hostvars.get('port') or hostvars.get('ansible_ssh_port') or hostvars.get('ansible_port', 23),
+      'user': hostvars.get('remote_user') or hostvars.get('ansible_ssh_user') or hostvars.get('ansible_user'),
+      'password': hostvars.get('password') or hostvars.get('ansible_ssh_pass') or hostvars.get('ansible_password') or hostvars.get('ansible_pass'), # ansible_pass is wrong setting
+      'become': hostvars.get('become') or hostvars.get('ansible_become', False),
+      'become_pass': hostvars.get('become_pass') or hostvars.get('ansible_become_password') or hostvars.get('ansible_become_pass'),
+      'network_os': hostvars.get('ansible_network_os')
+    }
+
+
+  def fanout_targets(self, task_vars):
+    """targets option for all hosts of the play batch, built from their inventory variables"""
+    targets = list()
+    for hostname in task_vars.get('ansible_play_batch') or [task_vars.get('inventory_hostname')]:
+      # the inventory hostname is the host unless ansible_host is given
+      target = {'name': hostname, 'host': hostname}
+      for key, value in self.host_params(task_vars['hostvars'].get(hostname)).items():
+        # keep explicit falsy values like become: false
+        if value is not None:
+          target[key] = value
+      if target.get('port', 23) == 22:
+        target['port'] = 23
+      targets.append(target)
+    return targets
+
+
+  def run_persistent(self, task_vars):
+    """run commands over the logged-in session of iida.telnet.telnet connection"""
+    socket_path = getattr(self._connection, 'socket_path', None) or task_vars.get('ansible_socket')
+    conn = Connection(socket_path)
+
+    try:
+      responses = conn.run_commands(commands=self._task.args.get('commands'), check_rc=False)
+    except AnsibleConnectionError as e:
+      return {
+        'failed': True,
+        'changed': False,
+        'msg': 'run_commands() failed',
+        'original_message': to_text(e)
+      }
+
+    tc = TelnetClient(self._task.args)
+    if self._task.args.get('debug'):
+      histories = conn.get_histories()
+      tc.prompt_histories = histories.get('prompt_histories')
+      tc.command_histories = histories.get('command_histories')
+    try:
+      for response in responses:
+        tc.log_response(response)
+    finally:
+      tc.close_log()
+    return tc.command_result(responses)
+
+
   def run(self, tmp=None, task_vars=None):
     del tmp  # tmp no longer has any effect
 
@@ -72,6 +162,13 @@ class ActionModule(_ActionModule):
     # if delegate_to is specified, we must run in module
     run_as_module = bool(hasattr(self._play_context, 'delegate_to'))
 
+    # fanout runs all hosts of the play in one module execution (use with run_once)
+    fanout = self._task.args.pop('fanout', False)
+
+    # with iida.telnet.telnet connection, the session is kept by the connection
+    # and login/logout is not needed in every task
+    use_persistent = self._play_context.connection == PERSISTENT_CONNECTION and not fanout
+
     #
     # get hostvars
     #
@@ -81,21 +178,9 @@ class ActionModule(_ActionModule):
     #
     # get info from inventories
     #
-    remote_addr = hostvars.get('remote_addr') or hostvars.get('ansible_ssh_host') or hostvars.get('ansible_host')
-    port = hostvars.get('port') or hostvars.get('ansible_ssh_port') or hostvars.get('ansible_port', 23)
-    remote_user = hostvars.get('remote_user') or hostvars.get('ansible_ssh_user') or hostvars.get('ansible_user')
-    password = hostvars.get('password') or hostvars.get('ansible_ssh_pass') or hostvars.get('ansible_password') or hostvars.get('ansible_pass') # ansible_pass is wrong setting
-    become = hostvars.get('become') or hostvars.get('ansible_become', False)
-    become_pass = hostvars.get('become_pass') or hostvars.get('ansible_become_password') or hostvars.get('ansible_become_pass')
-    network_os = hostvars.get('ansible_network_os')
-
-    # display.v(remote_addr)
-    # display.v(port)
-    # display.v(remote_user)
-    # display.v(password)
-    # display.v(str(become))
-    # display.v(become_pass)
-    # display.v(network_os)
+    params = self.host_params(hostvars)
+
+    # display.v(str(params))
 
     #
     # add info to self._task.args
@@ -118,35 +203,66 @@ class ActionModule(_ActionModule):
     #   command_timeout=dict(default=5, type='int'),
     #   pause=dict(default=1, type='int')
     #   )
-    if not self._task.args.get('host') and remote_addr:
-      self._task.args['host'] = remote_addr
+    # with targets, host, port and become of each target are its own, not those of the delegating host
+    targeted = fanout or self._task.args.get('targets')
+    for key, value in params.items():
+      if targeted and key in ('host', 'port', 'become'):
+        continue
+      if not self._task.args.get(key) and value:
+        self._task.args[key] = value
 
-    if not self._task.args.get('port') and port:
-      self._task.args['port'] = port
     if not self._task.args.get('port') or self._task.args.get('port') == 22:
       self._task.args['port'] = 23
 
-    if not self._task.args.get('user') and remote_user:
-      self._task.args['user'] = remote_user
-
-    if not self._task.args.get('password') and password:
-      self._task.args['password'] = password
-
-    if not self._task.args.get('become') and become:
-      self._task.args['become'] = become
-
-    if not self._task.args.get('become_pass') and become_pass:
-      self._task.args['become_pass'] = become_pass
-
-    if not self._task.args.get('network_os') and network_os:
-      self._task.args['network_os'] = network_os
+    if fanout and not self._task.args.get('targets'):
+      self._task.args['targets'] = self.fanout_targets(task_vars)
+
+    # relative stream_to is placed in the playbook or role directory like log,
+    # on the delegated host it is left to the module and is not fetched
+    if use_persistent or not run_as_module or self._connection.transport == 'local':
+      for cmd in self._task.args.get('commands') or []:
+        stream_to = cmd.get('stream_to') if isinstance(cmd, dict) else None
+        if stream_to and not os.path.isabs(stream_to) and not stream_to.startswith('~'):
+          cmd['stream_to'] = os.path.join(self.get_working_path(), stream_to)
+
+    # the log is written to log_path while the commands run
+    # without log_path, it is log/<inventory_hostname>_<timestamp>.log (the name of each target is prefixed with targets)
+    if self._task.args.get('log') is True and not self._task.args.get('log_path'):
+      tstamp = time.strftime("%Y-%m-%d@%H-%M-%S", time.localtime(time.time()))
+      if self._task.args.get('targets'):
+        self._task.args['log_path'] = 'log/{0}.log'.format(tstamp)
+      else:
+        self._task.args['log_path'] = 'log/{0}_{1}.log'.format(inventory_hostname, tstamp)
+
+    # relative log_path is placed in the playbook or role directory,
+    # the module on the delegated host writes it to a temporary directory and it is fetched after the run
+    fetch_log_path = None
+    log_path = self._task.args.get('log_path')
+    if log_path and not os.path.isabs(log_path) and not log_path.startswith('~'):
+      if use_persistent or not run_as_module or self._connection.transport == 'local':
+        self._task.args['log_path'] = os.path.join(self.get_working_path(), log_path)
+      else:
+        fetch_log_path = log_path
+
+    # the cache of the outputs is kept in the playbook or role directory when the module runs on the controller
+    use_cache = self._task.args.get('track_changes') or self._task.args.get('use_cache')
+    if use_cache and not self._task.args.get('cache_dir'):
+      if use_persistent or not run_as_module or self._connection.transport == 'local':
+        self._task.args['cache_dir'] = os.path.join(self.get_working_path(), 'cache')
 
     #
     # RUN THE MODULE
     #
 
-    if run_as_module:
+    if use_persistent:
+      result = self.run_persistent(task_vars)
+    elif run_as_module:
       result = super(ActionModule, self).run(task_vars=task_vars)
+      # placeholder to keep ansible from splitting stdout with result_format=stdout_only
+      if result.get('stdout_lines', '') is None:
+        del result['stdout_lines']
+    elif self._task.args.get('targets'):
+      result = TelnetClient.process_targets(self._task.args)
     else:
       tc = TelnetClient(self._task.args)
       result = tc.process_command()
@@ -155,8 +271,20 @@ class ActionModule(_ActionModule):
     # post process
     #
 
+    if fetch_log_path:
+      for host_result in [result] + list((result.get('host_results') or {}).values()):
+        if host_result.get('log_path'):
+          self.fetch_logs(host_result, fetch_log_path)
+    self.remove_log_tmpdir(result)
+
     if self._task.args.get('log') is True and result.get('__log__'):
       result['log_path'] = self.write_log(inventory_hostname, result.get('__log__'))
       del result['__log__']
 
+    # results of the targets are keyed by the name of each target (inventory_hostname with fanout)
+    for name, host_result in (result.get('host_results') or {}).items():
+      if self._task.args.get('log') is True and host_result.get('__log__'):
+        host_result['log_path'] = self.write_log(name, host_result.get('__log__'))
+        del host_result['__log__']
+
     return result
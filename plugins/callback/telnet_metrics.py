@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring, protected-access, broad-except
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+callback: iida.telnet.telnet_metrics
+
+type: aggregate
+
+short_description: Aggregate performance metrics of iida.telnet.command across the playbook run
+
+version_added: 2.9
+
+description:
+  - Collects the results of iida.telnet.command tasks and shows the summary per host and per command
+    at the end of the playbook run, the slowest ones first.
+  - Per command latency and bytes are taken from C(timings) of the result, set C(timings=yes) in the task to get them.
+    Without it, the duration of the task and the number of the failures and timeouts are collected.
+  - The results of C(fanout) are split into each host.
+  - The metrics can be exported to a JSON file and a Prometheus textfile (node_exporter textfile collector).
+
+requirements:
+  - whitelist in configuration (callback_whitelist = iida.telnet.telnet_metrics)
+
+options:
+  top:
+    description: Number of hosts and commands shown in the summary tables, 0 shows all.
+    type: int
+    default: 20
+    env:
+      - name: TELNET_METRICS_TOP
+    ini:
+      - section: callback_telnet_metrics
+        key: top
+  json_path:
+    description: Path of the JSON file to export the metrics.
+    env:
+      - name: TELNET_METRICS_JSON_PATH
+    ini:
+      - section: callback_telnet_metrics
+        key: json_path
+  prometheus_path:
+    description: Path of the Prometheus textfile to export the metrics, it should end with .prom.
+    env:
+      - name: TELNET_METRICS_PROMETHEUS_PATH
+    ini:
+      - section: callback_telnet_metrics
+        key: prometheus_path
+'''
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+# action name of the command module, the short name 'command' is ansible.builtin.command
+TELNET_ACTIONS = ('iida.telnet.command',)
+
+# the messages of the failures caused by timeout
+TIMEOUT_MESSAGES = ('Failed to expect', 'timeout', 'timed out')
+
+
+def is_telnet_task(task):
+  """True if the task runs iida.telnet.command, resolved_action is the FQCN of the short name (ansible 2.11 or later)"""
+  action = getattr(task, 'resolved_action', None) or task.action
+  return action in TELNET_ACTIONS
+
+
+class HostMetrics(object):
+  """metrics of one host"""
+
+  def __init__(self, name):
+    self.name = name
+    self.tasks = 0
+    self.failures = 0
+    self.timeouts = 0
+    self.duration = 0.0
+    self.commands = 0
+    self.command_time = 0.0
+    self.bytes_received = 0
+    self.recv_calls = 0
+
+
+  def throughput(self):
+    """bytes per second while waiting for the output of commands"""
+    return self.bytes_received / self.command_time if self.command_time else 0
+
+
+  def to_dict(self):
+    return {
+      'tasks': self.tasks,
+      'failures': self.failures,
+      'timeouts': self.timeouts,
+      'duration': round(self.duration, 4),
+      'commands': self.commands,
+      'command_time': round(self.command_time, 4),
+      'bytes_received': self.bytes_received,
+      'recv_calls': self.recv_calls,
+      'throughput': round(self.throughput(), 1)
+    }
+
+
+class CommandMetrics(object):
+  """metrics of one command across the hosts"""
+
+  def __init__(self, name):
+    self.name = name
+    self.latencies = list()
+    self.ttfbs = list()
+    self.bytes = 0
+
+
+  def add(self, timing):
+    self.latencies.append(timing.get('time_to_prompt') or 0)
+    if timing.get('ttfb') is not None:
+      self.ttfbs.append(timing.get('ttfb'))
+    self.bytes += timing.get('bytes') or 0
+
+
+  @staticmethod
+  def percentile(values, p):
+    if not values:
+      return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+  def to_dict(self):
+    count = len(self.latencies)
+    total = sum(self.latencies)
+    return {
+      'count': count,
+      'sum': round(total, 4),
+      'mean': round(total / count, 4) if count else 0,
+      'p95': round(self.percentile(self.latencies, 95), 4),
+      'max': round(max(self.latencies), 4) if count else 0,
+      'ttfb_mean': round(sum(self.ttfbs) / len(self.ttfbs), 4) if self.ttfbs else None,
+      'bytes': self.bytes
+    }
+
+
+class CallbackModule(CallbackBase):
+
+  CALLBACK_VERSION = 2.0
+  CALLBACK_TYPE = 'aggregate'
+  CALLBACK_NAME = 'iida.telnet.telnet_metrics'
+  CALLBACK_NEEDS_WHITELIST = True
+
+  def __init__(self, display=None):
+    super(CallbackModule, self).__init__(display=display)
+    self.hosts = dict()
+    self.commands = dict()
+    self.started = dict()
+    self.top = 20
+    self.json_path = None
+    self.prometheus_path = None
+
+
+  def set_options(self, task_keys=None, var_options=None, direct=None):
+    super(CallbackModule, self).set_options(task_keys=task_keys, var_options=var_options, direct=direct)
+    self.top = self.get_option('top')
+    self.json_path = self.get_option('json_path')
+    self.prometheus_path = self.get_option('prometheus_path')
+
+  #
+  # collect
+  #
+
+  def host_metrics(self, name):
+    if name not in self.hosts:
+      self.hosts[name] = HostMetrics(name)
+    return self.hosts[name]
+
+
+  def command_metrics(self, name):
+    if name not in self.commands:
+      self.commands[name] = CommandMetrics(name)
+    return self.commands[name]
+
+
+  def v2_runner_on_start(self, host, task):
+    if is_telnet_task(task):
+      self.started[(host.get_name(), task._uuid)] = time.time()
+
+
+  def add_result(self, name, result, duration, failed=False):
+    host = self.host_metrics(name)
+    host.tasks += 1
+    host.duration += duration
+
+    if failed or result.get('failed'):
+      host.failures += 1
+      message = '%s %s' % (result.get('msg', ''), result.get('original_message', ''))
+      if any(m in message for m in TIMEOUT_MESSAGES):
+        host.timeouts += 1
+
+    timings = result.get('timings') or {}
+    host.bytes_received += timings.get('bytes_received') or 0
+    host.recv_calls += timings.get('recv_calls') or 0
+    for timing in timings.get('commands') or []:
+      host.commands += 1
+      host.command_time += timing.get('time_to_prompt') or 0
+      self.command_metrics(timing.get('command')).add(timing)
+
+
+  def collect(self, result, failed=False):
+    task = result._task
+    if not is_telnet_task(task):
+      return
+
+    name = result._host.get_name()
+    started = self.started.pop((name, task._uuid), None)
+    duration = time.time() - started if started else 0
+
+    res = result._result
+    if res.get('host_results'):
+      # fanout, the results of the hosts are in one result
+      for host_name, host_result in res.get('host_results').items():
+        self.add_result(host_name, host_result, host_result.get('elapsed') or 0)
+      return
+
+    # the failed key may have been removed from the result, the callback method tells it
+    self.add_result(name, res, duration, failed=failed)
+
+
+  def v2_runner_on_ok(self, result):
+    self.collect(result)
+
+
+  def v2_runner_on_failed(self, result, ignore_errors=False):
+    self.collect(result, failed=True)
+
+
+  def v2_runner_on_unreachable(self, result):
+    self.collect(result, failed=True)
+
+  #
+  # report
+  #
+
+  def limit(self, items):
+    return items[:self.top] if self.top else items
+
+
+  def show_summary(self):
+    hosts = sorted(self.hosts.values(), key=lambda h: h.duration, reverse=True)
+    self._display.banner('TELNET METRICS: HOSTS')
+    self._display.display('{0:<30} {1:>6} {2:>6} {3:>8} {4:>10} {5:>9} {6:>12} {7:>12}'.format(
+      'host', 'tasks', 'failed', 'timeout', 'duration', 'commands', 'bytes', 'bytes/sec'))
+    for h in self.limit(hosts):
+      self._display.display('{0:<30} {1:>6} {2:>6} {3:>8} {4:>10.3f} {5:>9} {6:>12} {7:>12.0f}'.format(
+        h.name[:30], h.tasks, h.failures, h.timeouts, h.duration, h.commands, h.bytes_received, h.throughput()))
+
+    if not self.commands:
+      return
+
+    commands = sorted(self.commands.values(), key=lambda c: sum(c.latencies), reverse=True)
+    self._display.banner('TELNET METRICS: COMMANDS')
+    self._display.display('{0:<40} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9} {6:>12}'.format(
+      'command', 'count', 'mean', 'p95', 'max', 'ttfb', 'bytes'))
+    for c in self.limit(commands):
+      d = c.to_dict()
+      self._display.display('{0:<40} {1:>6} {2:>9.3f} {3:>9.3f} {4:>9.3f} {5:>9} {6:>12}'.format(
+        c.name[:40], d['count'], d['mean'], d['p95'], d['max'],
+        '%.3f' % d['ttfb_mean'] if d['ttfb_mean'] is not None else '-', d['bytes']))
+
+
+  def to_dict(self):
+    return {
+      'hosts': dict((name, h.to_dict()) for name, h in self.hosts.items()),
+      'commands': dict((name, c.to_dict()) for name, c in self.commands.items())
+    }
+
+
+  @staticmethod
+  def write_file(path, contents):
+    """write to a temporary file and rename it, so that the reader never sees a partial file"""
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+      f.write(contents)
+    os.rename(tmp_path, path)
+
+
+  @staticmethod
+  def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+  def to_prometheus(self):
+    lines = list()
+
+    def metric(name, kind, helptext, samples):
+      lines.append('# HELP iida_telnet_%s %s' % (name, helptext))
+      lines.append('# TYPE iida_telnet_%s %s' % (name, kind))
+      for labels, value in samples:
+        lines.append('iida_telnet_%s{%s} %s' % (name, labels, value))
+
+    hosts = sorted(self.hosts.items())
+    metric('host_duration_seconds', 'gauge', 'Seconds spent in iida.telnet.command tasks.',
+           [('host="%s"' % self.label(n), round(h.duration, 4)) for n, h in hosts])
+    metric('host_tasks_total', 'counter', 'Number of iida.telnet.command tasks.',
+           [('host="%s"' % self.label(n), h.tasks) for n, h in hosts])
+    metric('host_failures_total', 'counter', 'Number of failed tasks.',
+           [('host="%s"' % self.label(n), h.failures) for n, h in hosts])
+    metric('host_timeouts_total', 'counter', 'Number of tasks failed by timeout.',
+           [('host="%s"' % self.label(n), h.timeouts) for n, h in hosts])
+    metric('host_bytes_received_total', 'counter', 'Bytes received from the host.',
+           [('host="%s"' % self.label(n), h.bytes_received) for n, h in hosts])
+    metric('host_throughput_bytes_per_second', 'gauge', 'Bytes per second while waiting for the output of commands.',
+           [('host="%s"' % self.label(n), round(h.throughput(), 1)) for n, h in hosts])
+
+    commands = sorted((n, c.to_dict()) for n, c in self.commands.items())
+    if commands:
+      metric('command_time_to_prompt_seconds', 'summary', 'Seconds from sending the command to the prompt.',
+             [('command="%s",quantile="0.95"' % self.label(n), d['p95']) for n, d in commands])
+      lines.extend('iida_telnet_command_time_to_prompt_seconds_sum{command="%s"} %s' % (self.label(n), d['sum']) for n, d in commands)
+      lines.extend('iida_telnet_command_time_to_prompt_seconds_count{command="%s"} %s' % (self.label(n), d['count']) for n, d in commands)
+
+    return '\n'.join(lines) + '\n'
+
+
+  def v2_playbook_on_stats(self, stats):
+    if not self.hosts:
+      return
+
+    self.show_summary()
+
+    if self.json_path:
+      self.write_file(self.json_path, json.dumps(self.to_dict(), indent=2, sort_keys=True))
+      self._display.display('telnet metrics written to %s' % self.json_path)
+
+    if self.prometheus_path:
+      self.write_file(self.prometheus_path, self.to_prometheus())
+      self._display.display('telnet metrics written to %s' % self.prometheus_path)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+author:
+  - Takamitsu IIDA (@takamitsu-iida)
+
+cliconf: iida.telnet.telnet
+
+short_description: Use iida.telnet.telnet connection to run commands on network device
+
+description:
+  - This cliconf plugin sends commands over the logged-in session of iida.telnet.telnet connection.
+
+version_added: 2.9
+'''
+
+import json
+
+from ansible.errors import AnsibleConnectionFailure
+from ansible.module_utils.common._collections_compat import Mapping
+from ansible.module_utils.network.common.utils import to_list
+from ansible.plugins.cliconf import CliconfBase
+
+
+class Cliconf(CliconfBase):
+
+  def get_device_info(self):
+    return {
+      'network_os': self._connection.get_option('network_os')
+    }
+
+
+  def get_config(self, source='running', flags=None, format=None):
+    if source not in ('running', 'startup'):
+      raise ValueError("fetching configuration from %s is not supported" % source)
+
+    if source == 'running':
+      cmd = 'show running-config '
+    else:
+      cmd = 'show startup-config '
+
+    cmd += ' '.join(to_list(flags))
+    return self.send_command(cmd.strip())
+
+
+  def edit_config(self, candidate=None, commit=True, replace=None, comment=None):
+    raise AnsibleConnectionFailure('edit_config is not supported over telnet connection, use commands')
+
+
+  def get(self, command=None, prompt=None, answer=None, sendonly=False, newline=True, output=None, check_all=False):
+    if not command:
+      raise ValueError('must provide value of command to execute')
+    if output:
+      raise ValueError("'output' value %s is not supported for get" % output)
+
+    out = self.send_command(command=command, prompt=prompt, answer=answer, sendonly=sendonly, newline=newline, check_all=check_all)
+    self._connection.check_error(out)
+    return out
+
+
+  def get_capabilities(self):
+    result = super(Cliconf, self).get_capabilities()
+    result['rpc'] += ['run_commands']
+    result['device_info'] = self.get_device_info()
+    return json.dumps(result)
+
+
+  def run_commands(self, commands=None, check_rc=True):
+    """run commands in the same format as iida.telnet.command module
+
+    If check_rc is True, AnsibleConnectionFailure is raised when the device returns an error message,
+    otherwise the error message is returned as the response of the command.
+    """
+    if commands is None:
+      raise ValueError("'commands' value is required")
+
+    responses = list()
+    for cmd in to_list(commands):
+      if not isinstance(cmd, Mapping):
+        cmd = {'command': cmd}
+
+      if cmd.get('stream_to'):
+        out = self._connection.send(cmd.get('command'), prompt=cmd.get('prompt'), answer=cmd.get('answer'), stream_to=cmd.get('stream_to'))
+      else:
+        out = self.send_command(command=cmd.get('command'), prompt=cmd.get('prompt'), answer=cmd.get('answer'))
+
+      if check_rc:
+        self._connection.check_error(out)
+
+      responses.append(out)
+
+    return responses
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring, broad-except
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+author:
+  - Takamitsu IIDA (@takamitsu-iida)
+
+connection: iida.telnet.telnet
+
+short_description: Persistent telnet connection to network device
+
+description:
+  - This connection plugin keeps one logged-in telnet session to the network device
+    across the tasks of the playbook, instead of connecting and logging in for every task.
+  - Login, terminal setup and privilege escalation are done by TelnetClient (module_utils/telnet_util.py),
+    the same as the iida.telnet.command module.
+  - The session is closed when it has been idle for I(persistent_connect_timeout) seconds.
+
+version_added: 2.9
+
+options:
+  host:
+    description:
+      - The target host ip address(or DNS name)
+    vars:
+      - name: ansible_host
+
+  port:
+    type: int
+    description:
+      - The remote port
+    default: 23
+    ini:
+      - section: defaults
+        key: remote_port
+    env:
+      - name: ANSIBLE_REMOTE_PORT
+    vars:
+      - name: ansible_port
+
+  network_os:
+    description:
+      - network os type, ios, fujitsu_sir or fujitsu_srs
+    vars:
+      - name: ansible_network_os
+
+  remote_user:
+    description:
+      - The user for login
+    vars:
+      - name: ansible_user
+
+  password:
+    description:
+      - The password for login
+    vars:
+      - name: ansible_password
+      - name: ansible_ssh_pass
+
+  become:
+    type: boolean
+    description:
+      - Need privilege escalation or not
+    default: False
+    vars:
+      - name: ansible_become
+
+  become_pass:
+    description:
+      - The password for privilege escalation
+    vars:
+      - name: ansible_become_password
+      - name: ansible_become_pass
+
+  console:
+    type: boolean
+    description:
+      - target device is console server or not
+    default: False
+    vars:
+      - name: ansible_telnet_console
+
+  connect_timeout:
+    type: int
+    description:
+      - timeout for telnet to be connected
+    default: 10
+    vars:
+      - name: ansible_telnet_connect_timeout
+
+  login_timeout:
+    type: int
+    description:
+      - timeout for login prompt
+    default: 5
+    vars:
+      - name: ansible_telnet_login_timeout
+
+  command_timeout:
+    type: int
+    description:
+      - timeout for command prompt
+    default: 5
+    vars:
+      - name: ansible_telnet_command_timeout
+
+  retention:
+    description:
+      - How much of the session is kept in memory, C(off), C(ring) (the last I(retention_size) bytes of the output
+        and the last 100 prompts and commands) or C(full).
+      - The session may live long, do not use C(full) unless debugging.
+    default: ring
+    vars:
+      - name: ansible_telnet_retention
+
+  retention_size:
+    type: int
+    description:
+      - Bytes of the output kept when I(retention=ring)
+    default: 65536
+    vars:
+      - name: ansible_telnet_retention_size
+
+  persistent_connect_timeout:
+    type: int
+    description:
+      - Idle timeout in seconds. The logged-in session is kept for this period after the last task
+        used it, and then the session is closed.
+    default: 30
+    ini:
+      - section: persistent_connection
+        key: connect_timeout
+    env:
+      - name: ANSIBLE_PERSISTENT_CONNECT_TIMEOUT
+    vars:
+      - name: ansible_connect_timeout
+
+  persistent_command_timeout:
+    type: int
+    description:
+      - Seconds to wait for the response of one request to the persistent connection.
+    default: 30
+    ini:
+      - section: persistent_connection
+        key: command_timeout
+    env:
+      - name: ANSIBLE_PERSISTENT_COMMAND_TIMEOUT
+    vars:
+      - name: ansible_command_timeout
+
+  persistent_log_messages:
+    type: boolean
+    description:
+      - Log the messages of the persistent connection to the file set by log_path in ansible.cfg.
+    default: False
+    ini:
+      - section: persistent_connection
+        key: log_messages
+    env:
+      - name: ANSIBLE_PERSISTENT_LOG_MESSAGES
+    vars:
+      - name: ansible_persistent_log_messages
+'''
+
+from ansible.errors import AnsibleConnectionFailure
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.module_utils.six import string_types
+from ansible.plugins.connection import NetworkConnectionBase, ensure_connect
+from ansible.plugins.loader import cliconf_loader, terminal_loader
+
+# import from collection
+from ansible_collections.iida.telnet.plugins.module_utils.telnet_util import TelnetClient
+
+
+class Connection(NetworkConnectionBase):
+  """Persistent telnet connection built on TelnetClient"""
+
+  transport = 'iida.telnet.telnet'
+  has_pipelining = True
+
+  def __init__(self, play_context, new_stdin, *args, **kwargs):
+    super(Connection, self).__init__(play_context, new_stdin, *args, **kwargs)
+
+    self._telnet_client = None
+    self._terminal = None
+    self._connected = False
+
+    self.cliconf = cliconf_loader.get('iida.telnet.telnet', self)
+    if self.cliconf:
+      self._sub_plugin = {'type': 'cliconf', 'name': 'iida.telnet.telnet', 'obj': self.cliconf}
+      self.queue_message('vvvv', 'loaded cliconf plugin iida.telnet.telnet')
+    else:
+      raise AnsibleConnectionFailure('Unable to load cliconf plugin iida.telnet.telnet')
+
+
+  def telnet_params(self):
+    """build TelnetClient params from connection options"""
+    port = self.get_option('port') or 23
+    if port == 22:
+      port = 23
+
+    return {
+      'network_os': self.get_option('network_os') or self._network_os or 'ios',
+      'host': self.get_option('host') or self._play_context.remote_addr,
+      'port': port,
+      'user': self.get_option('remote_user') or self._play_context.remote_user,
+      'password': self.get_option('password') or self._play_context.password,
+      'become': self.get_option('become') or self._play_context.become,
+      'become_pass': self.get_option('become_pass') or self._play_context.become_pass,
+      'console': self.get_option('console'),
+      'connect_timeout': self.get_option('connect_timeout'),
+      'login_timeout': self.get_option('login_timeout'),
+      'command_timeout': self.get_option('command_timeout'),
+      'retention': self.get_option('retention'),
+      'retention_size': self.get_option('retention_size'),
+    }
+
+
+  def _connect(self):
+    if self.connected:
+      return
+
+    params = self.telnet_params()
+    self.queue_message('vvv', 'telnet connection to %s:%s' % (params.get('host'), params.get('port')))
+
+    self._terminal = terminal_loader.get('iida.telnet.telnet', self)
+    if not self._terminal:
+      raise AnsibleConnectionFailure('Unable to load terminal plugin iida.telnet.telnet')
+
+    tc = TelnetClient(params)
+    try:
+      result = tc.login()
+    except Exception as e:
+      raise AnsibleConnectionFailure('telnet login failed: %s' % to_text(e))
+    if result.get('failed'):
+      raise AnsibleConnectionFailure('%s %s' % (result.get('msg'), result.get('original_message', '')))
+
+    self._telnet_client = tc
+    self._connected = True
+    self.queue_message('vvvv', 'telnet login succeeded, prompt is %s' % tc.prompt)
+
+
+  def close(self):
+    if self._telnet_client is not None:
+      self.queue_message('vvvv', 'closing telnet session')
+      try:
+        self._telnet_client.logout()
+      except Exception:
+        pass
+      self._telnet_client = None
+    super(Connection, self).close()
+
+
+  def telnet_client(self):
+    """TelnetClient object of the logged-in session, login again if the session has been lost"""
+    if self._telnet_client is not None and self._telnet_client.connection is None:
+      self.queue_message('vvvv', 'telnet session has been lost, login again')
+      self._telnet_client = None
+      self._connected = False
+      self._connect()
+    return self._telnet_client
+
+
+  @ensure_connect
+  def send(self, command, prompt=None, answer=None, stream_to=None, **kwargs):
+    """send command over the logged-in session and return the output
+
+    kwargs are the arguments of network_cli send() which are not used here (newline, sendonly ...)
+    """
+    # CliconfBase.send_command() converts command, prompt and answer to bytes
+    if prompt is not None:
+      prompt = to_text(prompt)
+    if answer is not None:
+      answer = to_text(answer)
+
+    tc = self.telnet_client()
+    try:
+      return tc.send_and_wait(to_text(command), prompt=prompt, answer=answer, stream_to=stream_to)
+    except Exception as e:
+      raise AnsibleConnectionFailure(to_text(e))
+
+
+  def check_error(self, response):
+    """raise AnsibleConnectionFailure if the response is an error message of the device"""
+    if not isinstance(response, string_types):
+      return
+    for regex in self._terminal.terminal_stderr_re:
+      if regex.search(to_bytes(response)):
+        raise AnsibleConnectionFailure(response)
+
+
+  @ensure_connect
+  def get_histories(self):
+    """prompt and command histories of the session (for debug purpose)"""
+    tc = self.telnet_client()
+    return {
+      'prompt_histories': [to_text(p) for p in tc.prompt_histories],
+      'command_histories': [to_text(c) for c in tc.command_histories]
+    }
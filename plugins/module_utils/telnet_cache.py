@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring, broad-except
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+# local cache of the outputs of commands, one json file per host
+#
+# {
+#   "["ios", "show version"]": {"sha1": "...", "output": "...", "stored": 1577000000.0, "used": 1577000000.0},
+#   ...
+# }
+
+import difflib
+import fcntl
+import hashlib
+import json
+import os
+import re
+from time import time
+
+from ansible.module_utils._text import to_bytes
+
+
+def output_hash(output):
+  return hashlib.sha1(to_bytes(output, errors='surrogate_or_strict')).hexdigest()
+
+
+def unified_diff(before, after, command):
+  """unified diff of two outputs of the command, the format of 'prepared' in the diff of the result"""
+  lines = difflib.unified_diff(
+    before.splitlines(), after.splitlines(),
+    fromfile='%s (previous)' % command, tofile='%s (current)' % command, lineterm='')
+  return ''.join(line + '\n' for line in lines)
+
+
+def changed_lines(before, after):
+  """lines of after which are not in before at the same place
+
+  The opcodes of SequenceMatcher are used as unified_diff() does,
+  ndiff() is quadratic when many lines are changed.
+  """
+  after_lines = after.splitlines()
+  lines = list()
+  for tag, _, _, j1, j2 in difflib.SequenceMatcher(None, before.splitlines(), after_lines).get_opcodes():
+    if tag in ('replace', 'insert'):
+      lines.extend(after_lines[j1:j2])
+  return lines
+
+
+class ResultCache(object):
+  """outputs of the commands of one host in a json file
+
+  The entries are keyed by (network_os, command) in the file of the host.
+  The entries stored ttl seconds ago are expired (0 keeps them), and the least recently used
+  ones are evicted when there are more than size entries.
+  The file is locked while it is read and replaced, so that the processes and threads
+  running the same host merge their entries instead of overwriting them.
+  """
+
+  DEFAULT_SIZE = 100
+  DEFAULT_TTL = 0
+
+  def __init__(self, cache_dir, host, size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+    self.cache_dir = cache_dir
+    self.path = os.path.join(cache_dir, '%s.json' % re.sub(r'[^\w.-]', '_', str(host)))
+    self.size = size if size is not None else self.DEFAULT_SIZE
+    self.ttl = ttl or 0
+    self.entries = None
+    # keys of the entries served from the cache, their 'used' is written by update()
+    self.touched = set()
+
+
+  @staticmethod
+  def key(network_os, command):
+    return json.dumps([network_os, command])
+
+
+  def read(self):
+    try:
+      with open(self.path, encoding='utf-8') as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      return dict()
+
+
+  def load(self):
+    """entries of the file, the expired ones removed"""
+    if self.entries is None:
+      self.entries = self.expire(self.read())
+    return self.entries
+
+
+  def expire(self, entries, now=None):
+    if not self.ttl:
+      return entries
+    now = now or time()
+    return dict((k, v) for k, v in entries.items() if now - v.get('stored', 0) < self.ttl)
+
+
+  def evict(self, entries):
+    if self.size and len(entries) > self.size:
+      keys = sorted(entries, key=lambda k: entries[k].get('used', 0), reverse=True)
+      entries = dict((k, entries[k]) for k in keys[:self.size])
+    return entries
+
+
+  def get(self, network_os, command):
+    """entry of the command, None if it is not cached"""
+    return self.load().get(self.key(network_os, command))
+
+
+  def touch(self, network_os, command):
+    """mark the entry used, written to the file with the next update()"""
+    self.touched.add(self.key(network_os, command))
+
+
+  def update(self, outputs, network_os):
+    """store the outputs, dict keyed by the command, mark the touched entries used and write the file"""
+    now = time()
+    updates = dict()
+    for command, output in outputs.items():
+      updates[self.key(network_os, command)] = {
+        'sha1': output_hash(output),
+        'output': output,
+        'stored': now,
+        'used': now
+      }
+
+    if not os.path.exists(self.cache_dir):
+      try:
+        os.makedirs(self.cache_dir)
+      except OSError:
+        # made by another process
+        pass
+
+    with open(self.path + '.lock', 'w', encoding='utf-8') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      entries = self.expire(self.read(), now)
+      for key in self.touched:
+        if key in entries:
+          entries[key]['used'] = now
+      entries.update(updates)
+      entries = self.evict(entries)
+      tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+      with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+      os.rename(tmp_path, self.path)
+    self.entries = entries
+    self.touched = set()
+    return entries
@@ -7,19 +7,296 @@
 # telnetlib doc
 # https://docs.python.jp/3/library/telnetlib.html
 
+import gzip
+import hashlib
+import os
 import re
-from time import sleep
+import socket
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+from time import monotonic, sleep, time
 
 from ansible.module_utils._text import to_text, to_bytes
 from ansible.module_utils.network.common.utils import to_list
 from ansible.module_utils.six import string_types
 
+try:
+  import zstandard
+  HAS_ZSTD = True
+except ImportError:
+  HAS_ZSTD = False
+
 # Python3 telnetlib.py needs to be modified so that we can receive a lot of messages
 # from network device like show tech-support.
 if __name__ == '__main__':
-  from telnetlib import Telnet
+  from telnetlib import Telnet, TranscriptRecorder, expect_window, RECV_SIZE, RECV_SIZE_MAX
+  from telnet_cache import ResultCache, output_hash, unified_diff, changed_lines
 else:
-  from ansible_collections.iida.telnet.plugins.module_utils.telnetlib import Telnet
+  from ansible_collections.iida.telnet.plugins.module_utils.telnetlib import Telnet, TranscriptRecorder, expect_window, RECV_SIZE, RECV_SIZE_MAX
+  from ansible_collections.iida.telnet.plugins.module_utils.telnet_cache import ResultCache, output_hash, unified_diff, changed_lines
+
+
+def compile_prompts(prompts):
+  """tuple of compiled bytes regex from str, bytes or compiled regex"""
+  compiled = list()
+  for prompt in to_list(prompts):
+    if not hasattr(prompt, 'search'):
+      prompt = re.compile(to_bytes(prompt))
+    compiled.append(prompt)
+  return tuple(compiled)
+
+
+class PromptProfile(object):
+  """Prompt patterns and login commands of a network os
+
+  The patterns are compiled once when the profile is registered and shared by all TelnetClient objects.
+
+    on_login: commands sent after login, e.g. to disable the pager
+    become_command: command to elevate the privilege, answered with become_pass at become_prompt
+    logout_command: command to logout
+  """
+
+  DEFAULT_COMMAND_PROMPTS = [br"[\r\n]?[\w\+\-\.:\/\[\]]+(?:\([^\)]+\)){0,3}(?:[>#]) ?$"]
+  DEFAULT_LOGIN_PROMPTS = [br"[Ll]ogin: ?|[Uu]sername: ?"]
+  DEFAULT_PASSWORD_PROMPTS = [br"[\r\n](?:Local_)?[Pp]assword: ?$"]
+  DEFAULT_BECOME_PROMPT = '[Pp]assword: ?'
+
+  def __init__(self, command_prompts=None, login_prompts=None, password_prompts=None,
+               on_login=None, become_command=None, become_prompt=None, logout_command=None):
+    self.command_prompts = compile_prompts(command_prompts or self.DEFAULT_COMMAND_PROMPTS)
+    self.login_prompts = compile_prompts(login_prompts or self.DEFAULT_LOGIN_PROMPTS)
+    self.password_prompts = compile_prompts(password_prompts or self.DEFAULT_PASSWORD_PROMPTS)
+    self.on_login = tuple(to_list(on_login))
+    self.become_command = become_command
+    self.become_prompt = become_prompt or self.DEFAULT_BECOME_PROMPT
+    self.logout_command = logout_command
+
+
+# PromptProfile keyed by network_os, 'default' is used for unknown network_os
+PROMPT_PROFILES = dict()
+
+
+def register_prompt_profile(network_os, **kwargs):
+  r"""register PromptProfile(**kwargs) for network_os, replacing the existing one
+
+    register_prompt_profile('junos', command_prompts=[br'[\r\n]\S+@\S+[>#] ?$'], on_login=['set cli screen-length 0'], logout_command='exit')
+  """
+  profile = PromptProfile(**kwargs)
+  PROMPT_PROFILES[network_os] = profile
+  return profile
+
+
+def get_prompt_profile(network_os):
+  """PromptProfile of network_os"""
+  return PROMPT_PROFILES.get(network_os) or PROMPT_PROFILES['default']
+
+
+register_prompt_profile('default')
+
+register_prompt_profile(
+  'ios',
+  on_login=['terminal length 0', 'terminal width 512'],
+  become_command='enable',
+  logout_command='quit')
+
+for _network_os in ('fujitsu_sir', 'fujitsu_srs'):
+  register_prompt_profile(
+    _network_os,
+    on_login=['terminal pager disable'],
+    become_command='admin',
+    logout_command='exit')
+
+
+@lru_cache(maxsize=256)
+def user_prompt(prompt):
+  """compiled prompt given with the command, the same prompt is compiled only once"""
+  return compile_prompts(prompt)
+
+
+@lru_cache(maxsize=64)
+def repeated_prompt(prompt):
+  """regex of the prompt repeated after an answer"""
+  return (re.compile(re.escape(to_bytes(prompt)) + br'\s*$'),)
+
+
+@lru_cache(maxsize=256)
+def pipeline_boundary(prompt, command):
+  """regex of the prompt followed by the echo of the command"""
+  return (re.compile(br'[\r\n]' + re.escape(to_bytes(prompt)) + br' ?' + re.escape(to_bytes(command).strip())),)
+
+
+@lru_cache(maxsize=256)
+def prompt_window(prompts):
+  """expect_window() of the tuple of prompts, the regex is parsed only once"""
+  return expect_window(prompts)
+
+class OutputSpool(object):
+  """Write the output of a command to a file as it arrives
+
+  The command echo in the first line is dropped, line endings are converted to '\n'
+  and leading/trailing white spaces are stripped, the same as the output returned by
+  TelnetClient.send_and_wait(). Only the first and last preview bytes are kept in memory.
+  """
+
+  def __init__(self, path, command, preview=512):
+    self.path = path
+    self.command = to_bytes(command).strip()
+    self.preview = preview
+    self.size = 0
+    self.head = b''
+    self.tail = b''
+    self._first_line = b''  # buffer until the command echo line is complete
+    self._spaces = b''  # trailing white spaces held back until more output arrives
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname)
+    self._f = open(path, 'wb')
+
+
+  def write(self, data):
+    if self._first_line is not None:
+      data = self._first_line + data
+      i = data.find(b'\n')
+      if i < 0 and len(data) < 4096:
+        self._first_line = data
+        return
+      self._first_line = None
+      if i >= 0 and self.command and data[:i].strip() == self.command:
+        data = data[i+1:]
+
+    data = self._spaces + data
+    body = data.rstrip()
+    self._spaces = data[len(body):]
+    if not self.size:
+      body = body.lstrip()
+    if not body:
+      return
+    body = body.replace(b'\r\n', b'\n')
+
+    self._f.write(body)
+    self.size += len(body)
+    if len(self.head) < self.preview:
+      self.head = (self.head + body)[:self.preview]
+    self.tail = (self.tail + body)[-self.preview:]
+
+
+  def close(self):
+    """close the file and return the summary of the output"""
+    if self._first_line:
+      first_line, self._first_line = self._first_line, None
+      if first_line.strip() != self.command:
+        self.write(first_line)
+    self._f.close()
+    return {
+      'stream_to': self.path,
+      'bytes': self.size,
+      'head': to_text(self.head, errors='surrogate_or_replace'),
+      'tail': to_text(self.tail, errors='surrogate_or_replace')
+    }
+
+
+class SessionLog(object):
+  """Write the log of the session to a file as the responses arrive
+
+  compress is None, 'gzip' or 'zstd', the extension .gz or .zst is added to the path.
+  When max_size bytes (before compression) have been written, the file is rotated
+  like logging.handlers.RotatingFileHandler, path.1 is the newest of up to backups old files.
+  """
+
+  EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+  def __init__(self, path, compress=None, max_size=0, backups=5):
+    if compress == 'zstd' and not HAS_ZSTD:
+      raise Exception('zstandard is required for log_compress=zstd')
+    self.base = path
+    self.compress = compress if compress in self.EXTENSIONS else None
+    self.max_size = max_size or 0
+    self.backups = backups
+    self.path = self.file_path(0)
+    self.size = 0
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname)
+    self._f = self.open()
+
+
+  def file_path(self, index):
+    """path of the current file (index 0) or the rotated file"""
+    suffix = '.%d' % index if index else ''
+    return self.base + suffix + self.EXTENSIONS.get(self.compress, '')
+
+
+  def open(self):
+    if self.compress == 'gzip':
+      return gzip.open(self.path, 'wb')
+    if self.compress == 'zstd':
+      return zstandard.ZstdCompressor().stream_writer(open(self.path, 'wb'))
+    return open(self.path, 'wb')
+
+
+  def rotate(self):
+    self._f.close()
+    for i in range(self.backups - 1, 0, -1):
+      if os.path.exists(self.file_path(i)):
+        os.replace(self.file_path(i), self.file_path(i + 1))
+    if self.backups > 0:
+      os.replace(self.path, self.file_path(1))
+    self._f = self.open()
+    self.size = 0
+
+
+  def write(self, text):
+    data = to_bytes(text, errors='surrogate_or_strict')
+    if self.max_size and self.size and self.size + len(data) > self.max_size:
+      self.rotate()
+    self._f.write(data)
+    self.size += len(data)
+
+
+  def files(self):
+    """the current file and the rotated files, the newest first"""
+    return [self.file_path(i) for i in range(self.backups + 1) if os.path.exists(self.file_path(i))]
+
+
+  def close(self):
+    if self._f is not None:
+      self._f.close()
+      self._f = None
+
+
+class OutputBuffer(object):
+  """Keep the output received in the session, up to the last size bytes
+
+  size None keeps everything, 0 keeps nothing.
+  """
+
+  def __init__(self, size=None):
+    self.size = size
+    self._buf = bytearray()
+
+
+  def append(self, data):
+    if self.size == 0:
+      return
+    if self.size is not None and len(data) >= self.size:
+      self._buf = bytearray(data[-self.size:])
+      return
+    self._buf += data
+    # trim when it has grown twice the size, so that the cost is amortized
+    if self.size is not None and len(self._buf) > 2 * self.size:
+      del self._buf[:len(self._buf) - self.size]
+
+
+  def getvalue(self):
+    if self.size is None:
+      return bytes(self._buf)
+    return bytes(self._buf[-self.size:]) if self.size else b''
+
+
+  def __len__(self):
+    return len(self._buf) if self.size is None else min(len(self._buf), self.size)
+
 
 class TelnetClient(object):
 
@@ -29,7 +306,36 @@ class TelnetClient(object):
   DEFAULT_LOGIN_TIMEOUT = 5
   DEFAULT_COMMAND_TIMEOUT = 5
   DEFAULT_PAUSE = 1
+  DEFAULT_PACING = 'prompt'
+  DEFAULT_PIPELINE = False
+  DEFAULT_PIPELINE_WINDOW = 8
+  DEFAULT_PIPELINE_ALLOW = r'^show '
   DEFAULT_CONSOLE = False
+  DEFAULT_CONCURRENCY = 32
+  DEFAULT_RECV_SIZE = RECV_SIZE
+  DEFAULT_RECV_SIZE_MAX = RECV_SIZE_MAX
+  DEFAULT_RESULT_FORMAT = 'full'
+  DEFAULT_LOG_BACKUPS = 5
+  DEFAULT_CACHE_DIR = '~/.ansible/telnet_cache'
+  DEFAULT_CACHE_MAX_AGE = 60
+  DEFAULT_CACHE_ALLOW = r'^show '
+  DEFAULT_RETENTION = 'ring'
+  DEFAULT_RETENTION_SIZE = 65536
+
+  # white spaces before the command echo, see clean_output()
+  LEADING_SPACE = re.compile(br'\s*')
+
+  # number of prompts and commands kept in the histories when retention is ring
+  HISTORY_SIZE = 100
+
+  # adaptive pacing waits this ratio of the median prompt latency between commands
+  ADAPTIVE_PACING_RATIO = 0.5
+
+  # seconds without any output to regard the line as quiet
+  QUIET_TIME = 0.1
+
+  # lower bound of the quiet seconds waiting for the prompt repeated after an answer
+  REPEATED_PROMPT_QUIET_MIN = 0.01
 
   def __init__(self, params):
     """constructor for TelnetClient class
@@ -48,9 +354,35 @@ class TelnetClient(object):
       - login_timeout
       - command_timeout
       - pause
+      - pacing
+      - pipeline
+      - pipeline_window
+      - pipeline_allow
       - console
+      - recv_size
+      - recv_size_max
+      - rcvbuf
+      - retention
+      - retention_size
+      - record_path
+      - replay_path
+      - replay_realtime
+      - result_format
+      - track_changes
+      - changes_only
+      - cache_dir
+      - cache_size
+      - cache_ttl
+      - use_cache
+      - cache_max_age
+      - cache_allow
       - log
+      - log_path
+      - log_compress
+      - log_max_size
+      - log_backups
       - debug
+      - timings
 
     Arguments:
         params {dict} -- param dictionary
@@ -71,35 +403,92 @@ class TelnetClient(object):
     self._connect_timeout = params.get('connect_timeout', self.DEFAULT_CONNECT_TIMEOUT)
     self._login_timeout = params.get('login_timeout', self.DEFAULT_LOGIN_TIMEOUT)
     self._command_timeout = params.get('command_timeout', self.DEFAULT_COMMAND_TIMEOUT)
-    self._pause = params.get('pause', self.DEFAULT_PAUSE)
+    # an explicit pause without pacing keeps the fixed pause of the older versions
+    pause = params.get('pause')
+    self._pause = pause if pause is not None else self.DEFAULT_PAUSE
+    self._pacing = params.get('pacing') or ('fixed' if pause is not None else self.DEFAULT_PACING)
+    self._pipeline = params.get('pipeline', self.DEFAULT_PIPELINE)
+    self._pipeline_window = params.get('pipeline_window') or self.DEFAULT_PIPELINE_WINDOW
+    self._pipeline_allow = re.compile(params.get('pipeline_allow') or self.DEFAULT_PIPELINE_ALLOW)
     self._console = params.get('console', self.DEFAULT_CONSOLE)
+    self._recv_size = params.get('recv_size') or self.DEFAULT_RECV_SIZE
+    self._recv_size_max = params.get('recv_size_max') or self.DEFAULT_RECV_SIZE_MAX
+    self._rcvbuf = params.get('rcvbuf')
+    self._retention = params.get('retention') or self.DEFAULT_RETENTION
+    self._retention_size = params.get('retention_size') or self.DEFAULT_RETENTION_SIZE
+    self._result_format = params.get('result_format') or self.DEFAULT_RESULT_FORMAT
+    self._record_path = params.get('record_path')
+    self._replay_path = params.get('replay_path')
+    self._replay_realtime = params.get('replay_realtime', False)
+    self._track_changes = params.get('track_changes', False)
+    self._changes_only = params.get('changes_only', False)
+    self._cache_dir = params.get('cache_dir') or self.DEFAULT_CACHE_DIR
+    self._cache_size = params.get('cache_size', ResultCache.DEFAULT_SIZE)
+    self._cache_ttl = params.get('cache_ttl', ResultCache.DEFAULT_TTL)
+    self._use_cache = params.get('use_cache', False)
+    self._cache_max_age = params.get('cache_max_age', self.DEFAULT_CACHE_MAX_AGE)
+    self._cache_allow = re.compile(params.get('cache_allow') or self.DEFAULT_CACHE_ALLOW)
 
     self._log = params.get('log', False)
+    self._log_path = params.get('log_path')
+    self._log_compress = params.get('log_compress')
+    self._log_max_size = params.get('log_max_size') or 0
+    self._log_backups = params.get('log_backups', self.DEFAULT_LOG_BACKUPS)
     self._debug = params.get('debug', False)
-
-    # output buffer
-    self._raw_outputs = list()
+    self._timings = params.get('timings', False)
+
+    # output buffer, histories and raw output are kept according to retention
+    #   off: nothing is kept
+    #   ring: the last retention_size bytes of the output and the last HISTORY_SIZE prompts and commands
+    #   full: everything
+    if self._retention == 'full':
+      self._raw_outputs = OutputBuffer()
+      history_size = None
+    elif self._retention == 'off':
+      self._raw_outputs = OutputBuffer(0)
+      history_size = 0
+    else:
+      self._raw_outputs = OutputBuffer(self._retention_size)
+      history_size = self.HISTORY_SIZE
 
     # command history buffer
-    self.command_histories = list()
+    self.command_histories = deque(maxlen=history_size)
 
     # current prompt
     self.prompt = ""
 
     # prompt history buffer
-    self.prompt_histories = list()
+    self.prompt_histories = deque(maxlen=history_size)
+
+    # seconds from sending a command to receiving the prompt
+    self.prompt_latencies = list()
+
+    # pacing summary of run_commands()
+    self.pacing_result = None
+
+    # seconds spent in each phase, returned when timings is True
+    self.timing_data = {
+      'commands': list()
+    }
+
+    # precompiled prompt regex of the network_os, see register_prompt_profile()
+    profile = get_prompt_profile(self._network_os)
 
     # list of command prompt regex
-    self.command_prompts = list()
-    self.command_prompts.append(re.compile(br"[\r\n]?[\w\+\-\.:\/\[\]]+(?:\([^\)]+\)){0,3}(?:[>#]) ?$"))
+    self.command_prompts = list(profile.command_prompts)
 
     # list of login prompt regex
-    self.login_prompts = list()
-    self.login_prompts.append(re.compile(br"[Ll]ogin: ?|[Uu]sername: ?"))
+    self.login_prompts = list(profile.login_prompts)
 
     # list of password prompt regex
-    self.password_prompts = list()
-    self.password_prompts.append(re.compile(br"[\r\n](?:Local_)?[Pp]assword: ?$"))
+    self.password_prompts = list(profile.password_prompts)
+
+    # ResultCache object of this host, and the outputs served from it keyed by the index of the command
+    self._result_cache = None
+    self.cache_hits = dict()
+
+    # SessionLog object, opened by open_log() when log and log_path are given
+    self.session_log = None
 
     # Telnet class object
     self.connection = None
@@ -198,6 +587,27 @@ class TelnetClient(object):
     self._pause = _[0]
     return self
 
+  def pacing(self, *_):
+    """get/set _pacing"""
+    if not _:
+      return self._pacing
+    self._pacing = _[0]
+    return self
+
+  def pipeline(self, *_):
+    """get/set _pipeline"""
+    if not _:
+      return self._pipeline
+    self._pipeline = _[0]
+    return self
+
+  def pipeline_window(self, *_):
+    """get/set _pipeline_window"""
+    if not _:
+      return self._pipeline_window
+    self._pipeline_window = _[0]
+    return self
+
   def console(self, *_):
     """get/set _console"""
     if not _:
@@ -205,6 +615,104 @@ class TelnetClient(object):
     self._console = _[0]
     return self
 
+  def recv_size(self, *_):
+    """get/set _recv_size"""
+    if not _:
+      return self._recv_size
+    self._recv_size = _[0]
+    return self
+
+  def recv_size_max(self, *_):
+    """get/set _recv_size_max"""
+    if not _:
+      return self._recv_size_max
+    self._recv_size_max = _[0]
+    return self
+
+  def rcvbuf(self, *_):
+    """get/set _rcvbuf"""
+    if not _:
+      return self._rcvbuf
+    self._rcvbuf = _[0]
+    return self
+
+  def retention(self, *_):
+    """get/set _retention"""
+    if not _:
+      return self._retention
+    self._retention = _[0]
+    return self
+
+  def retention_size(self, *_):
+    """get/set _retention_size"""
+    if not _:
+      return self._retention_size
+    self._retention_size = _[0]
+    return self
+
+  def record_path(self, *_):
+    """get/set _record_path"""
+    if not _:
+      return self._record_path
+    self._record_path = _[0]
+    return self
+
+  def replay_path(self, *_):
+    """get/set _replay_path"""
+    if not _:
+      return self._replay_path
+    self._replay_path = _[0]
+    return self
+
+  def replay_realtime(self, *_):
+    """get/set _replay_realtime"""
+    if not _:
+      return self._replay_realtime
+    self._replay_realtime = _[0]
+    return self
+
+  def track_changes(self, *_):
+    """get/set _track_changes"""
+    if not _:
+      return self._track_changes
+    self._track_changes = _[0]
+    return self
+
+  def changes_only(self, *_):
+    """get/set _changes_only"""
+    if not _:
+      return self._changes_only
+    self._changes_only = _[0]
+    return self
+
+  def use_cache(self, *_):
+    """get/set _use_cache"""
+    if not _:
+      return self._use_cache
+    self._use_cache = _[0]
+    return self
+
+  def cache_dir(self, *_):
+    """get/set _cache_dir"""
+    if not _:
+      return self._cache_dir
+    self._cache_dir = _[0]
+    return self
+
+  def result_format(self, *_):
+    """get/set _result_format"""
+    if not _:
+      return self._result_format
+    self._result_format = _[0]
+    return self
+
+  def timings(self, *_):
+    """get/set _timings"""
+    if not _:
+      return self._timings
+    self._timings = _[0]
+    return self
+
   def raw_outputs(self, *_):
     """get/set _raw_outputs"""
     if not _:
@@ -222,9 +730,64 @@ class TelnetClient(object):
       yield item
 
 
+  def to_summary(self, responses):
+    """summary of each response, bytes, lines and sha1 instead of the output"""
+    summary = list()
+    for cmd, response in zip(to_list(self.commands()), responses):
+      command = cmd.get('command', '') if isinstance(cmd, dict) else cmd
+      if isinstance(response, string_types):
+        data = to_bytes(response, errors='surrogate_or_strict')
+        summary.append({
+          'command': command,
+          'bytes': len(data),
+          'lines': data.count(b'\n') + 1 if data else 0,
+          'sha1': hashlib.sha1(data).hexdigest()
+        })
+      else:
+        response = response or {}
+        summary.append({
+          'command': command,
+          'bytes': response.get('bytes'),
+          'stream_to': response.get('stream_to')
+        })
+    return summary
+
+
+  def to_log(self, response):
+    """response to log text, the output written to stream_to file is not logged"""
+    if isinstance(response, string_types):
+      return response
+    return '(%d bytes written to %s)' % (response.get('bytes'), response.get('stream_to'))
+
+
+  def open_log(self):
+    """open the log file of log_path, None if the log is not written to a file"""
+    if self.session_log is None and self._log and self._log_path:
+      self.session_log = SessionLog(
+        self._log_path, compress=self._log_compress, max_size=self._log_max_size, backups=self._log_backups)
+    return self.session_log
+
+
+  def log_response(self, response):
+    """write the response to the log file as soon as it is received"""
+    session_log = self.open_log()
+    if session_log is not None:
+      session_log.write(self.to_log(response) + '\n')
+
+
+  def close_log(self):
+    if self.session_log is not None:
+      self.session_log.close()
+
+
   def add_raw_outputs(self, output):
     """add output to raw_outputs"""
-    self.raw_outputs().append(to_text(output, errors='surrogate_or_strict'))
+    self.raw_outputs().append(output)
+
+
+  def raw_output_text(self):
+    """output kept in raw_outputs as text"""
+    return to_text(self.raw_outputs().getvalue(), errors='surrogate_or_strict')
 
 
   def add_command_histories(self, cmd):
@@ -254,13 +817,32 @@ class TelnetClient(object):
     connect_timeout = self.connect_timeout()
 
     # try to connect target host using telnetlib.Telnet
+    # with replay_path, the recorded session is played back instead
     tn = None
+    start = monotonic()
     try:
-      # tn = telnetlib.Telnet(host, port=port, timeout=connect_timeout)
-      tn = Telnet(host, port=port, timeout=connect_timeout)
+      if self.replay_path():
+        tn = Telnet(recv_size=self.recv_size(), recv_size_max=self.recv_size_max())
+        tn.open_replay(self.replay_path(), realtime=self.replay_realtime())
+      else:
+        # tn = telnetlib.Telnet(host, port=port, timeout=connect_timeout)
+        tn = Telnet(host, port=port, timeout=connect_timeout,
+                    recv_size=self.recv_size(), recv_size_max=self.recv_size_max(), rcvbuf=self.rcvbuf())
       self.connection = tn
     except OSError:
       return None
+    finally:
+      self.timing_data['connect'] = round(monotonic() - start, 4)
+
+    # record the byte stream of the session to replay it later
+    if self.record_path():
+      tn.set_recorder(TranscriptRecorder(self.record_path(), meta={
+        'host': host,
+        'port': port,
+        'network_os': self.network_os(),
+        'become': bool(self.become() is True and self.become_pass()),
+        'commands': [cmd.get('command', '') if isinstance(cmd, dict) else cmd for cmd in to_list(self.commands())]
+      }))
 
     # tn.set_debuglevel(10)
     return tn
@@ -268,10 +850,67 @@ class TelnetClient(object):
 
   def close_connection(self):
     if self.connection:
+      self.update_counters()
       self.connection.close()
+      if self.connection.recorder is not None:
+        self.connection.recorder.close()
       self.connection = None
 
 
+  def update_counters(self):
+    """copy the recv() counters of the connection to timing_data"""
+    tn = self.connection
+    if tn is None:
+      return
+    self.timing_data['bytes_received'] = tn.bytes_received
+    self.timing_data['recv_calls'] = tn.recv_calls
+    recv_size = {
+      'initial': self.recv_size(),
+      'peak': tn.recv_size_peak,
+      'last': tn.recv_size
+    }
+    if tn.sock is not None:
+      try:
+        # linux reports the doubled size including the bookkeeping overhead
+        recv_size['rcvbuf'] = tn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+      except OSError:
+        pass
+    self.timing_data['recv_size'] = recv_size
+
+
+  def ttfb(self):
+    """seconds from the last write() to the first byte received after it"""
+    tn = self.connection
+    if tn is None or tn.write_time is None or tn.first_recv_time is None:
+      return None
+    return round(tn.first_recv_time - tn.write_time, 4)
+
+
+  def add_command_timing(self, command, start, counters, ttfb=None):
+    """record the timing of a command, counters is (bytes_received, recv_calls) when it was sent"""
+    tn = self.connection
+    if tn is None:
+      return
+    self.timing_data['commands'].append({
+      'command': command,
+      'ttfb': ttfb,
+      'time_to_prompt': round(monotonic() - start, 4),
+      'bytes': tn.bytes_received - counters[0],
+      'recv_calls': tn.recv_calls - counters[1]
+    })
+
+
+  def abort(self):
+    """abort the session from another thread, the blocking expect() raises EOFError"""
+    tn = self.connection
+    if tn is None or tn.sock is None:
+      return
+    try:
+      tn.sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+
+
   def login(self):
     """Login to the target host"""
     result = {
@@ -291,13 +930,17 @@ class TelnetClient(object):
     login_prompts = self.login_prompts
     password_prompts = self.password_prompts
 
+    stages = self.timing_data['login'] = dict()
+    start = monotonic()
+
     try:
       if self.console():
-        sleep(2)
+        # wait for the banner of the console server to finish, then wake up the console
+        self.wait_quiet(login_prompts + command_prompts, login_timeout)
         tn.write(b'\n')
 
       if self.user():
-        index, match, out = tn.expect(login_prompts, login_timeout)
+        index, match, out = self.expect(login_prompts, login_timeout)
         if index < 0:
           self.close_connection()
           result['msg'] = "Failed to expect login prompt"
@@ -305,10 +948,12 @@ class TelnetClient(object):
           return result
         self.match_prompt(match)
         self.add_raw_outputs(out)
+        stages['login_prompt'] = round(monotonic() - start, 4)
+        start = monotonic()
         tn.write(to_bytes('%s\n' % user))
 
       if password:
-        index, match, out = tn.expect(password_prompts, login_timeout)
+        index, match, out = self.expect(password_prompts, login_timeout)
         if index < 0:
           self.close_connection()
           result['msg'] = "Failed to expect password prompt"
@@ -316,10 +961,12 @@ class TelnetClient(object):
           return result
         self.match_prompt(match)
         self.add_raw_outputs(out)
+        stages['password_prompt'] = round(monotonic() - start, 4)
+        start = monotonic()
         tn.write(to_bytes('%s\n' % password))
 
       # wait for command prompt
-      index, match, out = tn.expect(command_prompts, login_timeout)
+      index, match, out = self.expect(command_prompts, login_timeout)
       if index < 0:
         self.close_connection()
         result['msg'] = "Wrong password or failed to expect prompt"
@@ -327,9 +974,15 @@ class TelnetClient(object):
         return result
       self.match_prompt(match)
       self.add_raw_outputs(out)
+      stages['command_prompt'] = round(monotonic() - start, 4)
 
+      start = monotonic()
       self.on_login()
+      self.timing_data['on_login'] = round(monotonic() - start, 4)
+
+      start = monotonic()
       self.on_become()
+      self.timing_data['on_become'] = round(monotonic() - start, 4)
 
     except EOFError as e:
       self.close_connection()
@@ -341,17 +994,14 @@ class TelnetClient(object):
     return result
 
 
-  def on_login(self):
-    network_os = self.network_os()
+  def prompt_profile(self):
+    """PromptProfile of the network_os"""
+    return get_prompt_profile(self.network_os())
 
-    if network_os == 'ios':
-      self.send_and_wait('terminal length 0')
-      self.send_and_wait('terminal width 512')
-      return
 
-    if network_os in ('fujitsu_sir', 'fujitsu_srs'):
-      self.send_and_wait('terminal pager disable')
-      return
+  def on_login(self):
+    for command in self.prompt_profile().on_login:
+      self.send_and_wait(command)
 
 
   def on_become(self):
@@ -365,20 +1015,15 @@ class TelnetClient(object):
     if not become_pass:
       return
 
-    network_os = self.network_os()
-    if network_os == 'ios':
-      # in case of ios, send 'enable' and wait for Password:
-      self.send_and_wait('enable', prompt='[Pp]assword: ?', answer=become_pass)
-      if not self.prompt or not self.prompt.endswith('#'):
-        self.close_connection()
-        raise Exception('failed to elevate privilege to enable mode still at prompt [%s]' % self.prompt)
+    # send 'enable' in case of ios, 'admin' in case of fujitsu device, and wait for Password:
+    profile = self.prompt_profile()
+    if not profile.become_command:
+      return
 
-    if network_os in ('fujitsu_sir', 'fujitsu_srs'):
-      # in case of fujitsu device, send 'admin' and wait for Password:
-      self.send_and_wait('admin', prompt='[Pp]assword: ?', answer=become_pass)
-      if not self.prompt or not self.prompt.endswith(b'#'):
-        self.close_connection()
-        raise Exception('failed to elevate privilege to enable mode still at prompt [%s]' % self.prompt)
+    self.send_and_wait(profile.become_command, prompt=profile.become_prompt, answer=become_pass)
+    if not self.prompt or not self.prompt.endswith('#'):
+      self.close_connection()
+      raise Exception('failed to elevate privilege to enable mode still at prompt [%s]' % self.prompt)
 
 
   def logout(self):
@@ -387,13 +1032,9 @@ class TelnetClient(object):
     if tn is None:
       return
 
-    network_os = self.network_os()
-
-    if network_os == 'ios':
-      self.send_command('quit')
-
-    if network_os in ('fujitsu_sir', 'fujitsu_srs'):
-      self.send_command('exit')
+    logout_command = self.prompt_profile().logout_command
+    if logout_command:
+      self.send_command(logout_command)
 
     self.close_connection()
 
@@ -407,6 +1048,55 @@ class TelnetClient(object):
     self.add_command_histories(command)
 
 
+  def expect(self, prompts, timeout, sink=None):
+    """wait for one of prompts
+
+    Only the tail of the received output is rescanned on every recv(),
+    so the cost of waiting for the prompt does not grow with the size of the output.
+    If sink is given, the output before the tail is passed to sink() as it arrives.
+    """
+    tn = self.get_connection()
+    prompts = tuple(prompts)
+    return tn.expect(prompts, timeout, window=prompt_window(prompts), sink=sink)
+
+
+  def wait_quiet(self, prompts, timeout, quiet=None):
+    """wait until one of prompts is received or the line goes quiet
+
+    The line is quiet when nothing is received for quiet seconds (QUIET_TIME by default).
+    Returns (index, match, text) like Telnet.expect(), index is -1 if the line went quiet
+    or timeout seconds passed without the prompt.
+    """
+    quiet = quiet or self.QUIET_TIME
+    deadline = monotonic() + timeout
+    received = b''
+    while True:
+      remaining = deadline - monotonic()
+      if remaining <= 0:
+        return -1, None, received
+      index, match, out = self.expect(prompts, min(quiet, remaining))
+      received += out
+      if index >= 0 or not out:
+        return index, match, received
+
+
+  def wait_repeated_prompt(self, latency):
+    """consume the prompt repeated after an answer
+
+    The device may print the prompt twice, for the answer and for the newline after it.
+      csr#
+      csr#
+    Wait for the repeated prompt, or for the line to be quiet twice as long as
+    the device took to return the first prompt (REPEATED_PROMPT_QUIET_MIN at least),
+    bounded by command_timeout.
+    """
+    if not self.prompt:
+      return b''
+    quiet = max(self.REPEATED_PROMPT_QUIET_MIN, 2 * latency)
+    _, _, out = self.wait_quiet(repeated_prompt(self.prompt), self.command_timeout(), quiet=quiet)
+    return out
+
+
   def match_prompt(self, match):
     """regex match object to prompt string
     """
@@ -417,81 +1107,257 @@ class TelnetClient(object):
     return matched_prompt
 
 
-  def send_and_wait(self, command, prompt=None, answer=None):
-    """Send a command and wait for prompt"""
+  def send_and_wait(self, command, prompt=None, answer=None, stream_to=None):
+    """Send a command and wait for prompt
+
+    If stream_to is given, the output is written to the file as it arrives
+    and the summary dict of OutputSpool.close() is returned instead of the output.
+    """
     tn = self.get_connection()
     if tn is None:
       return
 
     command_timeout = self.command_timeout()
+    answered = None
 
     try:
+      start = monotonic()
+      counters = (tn.bytes_received, tn.recv_calls)
       self.send_command(command)
 
       if prompt:
-        index, match, out = tn.expect([to_bytes(prompt)], command_timeout)
+        index, match, out = self.expect(user_prompt(prompt), command_timeout)
         if index < 0:
           self.close_connection()
           raise Exception('Failed to expect prompt: %s : %s' % (command, prompt))
+        ttfb = self.ttfb()
         matched_prompt = self.match_prompt(match)
         self.add_raw_outputs(out)
 
         if answer is not None:
+          answered = monotonic()
           self.send_command(answer)
-          # in case of no output like this, we need to wait for the second prompt
-          # simply wait 1 second here.
-          # csr#>
-          # csr#>
-          sleep(1)
         else:
+          self.add_command_timing(command, start, counters, ttfb=ttfb)
           return to_text(out, errors='surrogate_or_strict')
 
-      index, match, out = tn.expect(self.command_prompts, command_timeout)
+      if stream_to:
+        response = self.stream_and_wait(command, stream_to)
+        if answered:
+          self.wait_repeated_prompt(monotonic() - answered)
+        self.add_command_timing(command, start, counters, ttfb=ttfb if prompt else self.ttfb())
+        return response
+
+      index, match, out = self.expect(self.command_prompts, command_timeout)
       if index < 0:
         self.close_connection()
         raise Exception('Failed to expect prompts: %s' % command)
+      self.prompt_latencies.append(monotonic() - start)
+      if not prompt:
+        ttfb = self.ttfb()
       matched_prompt = self.match_prompt(match)
+      if answered:
+        out += self.wait_repeated_prompt(monotonic() - answered)
       self.add_raw_outputs(out)
+      self.add_command_timing(command, start, counters, ttfb=ttfb)
+
+      return self.clean_output(command, matched_prompt, out)
+
+    except EOFError as e:
+      self.close_connection()
+      raise Exception('Telnet action failed: %s' % to_text(e))
+
 
-      # remove command echo and tailing prompt
-      # lines = out.splitlines()
-      # if len(lines) >= 1:
-      #   lines = lines[1:-1]
-      # out = '\n'.join(lines)
-      cleaned = []
-      for line in to_text(out, errors='surrogate_or_strict').splitlines():
-        if (command and line.strip() == command.strip()) or (matched_prompt and (matched_prompt == line.strip())):
-          continue
-        cleaned.append(line)
+  def clean_output(self, command, matched_prompt, out):
+    """remove command echo and tailing prompt from the output
 
-      return '\n'.join(cleaned).strip()
+    The echo is the first line and the prompt is the last lines, so they are cut
+    from the bytes looking only at both ends, and the rest is decoded once
+    with the line breaks normalized to '\\n'.
+    """
+    out = to_bytes(out, errors='surrogate_or_strict')
+    start = self.LEADING_SPACE.match(out).end()
+    end = len(out)
+
+    # command echo in the first line
+    if command:
+      echo = to_bytes(command, errors='surrogate_or_strict').strip()
+      limit = min(end, start + len(echo) + 16)
+      eol = min(i for i in (out.find(b'\n', start, limit), out.find(b'\r', start, limit), limit) if i >= 0)
+      if out[start:eol].strip() == echo:
+        start = self.LEADING_SPACE.match(out, eol).end()
+
+    # prompt in the last lines, repeated after an answer
+    if matched_prompt:
+      prompt = to_bytes(matched_prompt, errors='surrogate_or_strict')
+      while end > start:
+        while end > start and out[end - 1:end].isspace():
+          end -= 1
+        bol = max(out.rfind(b'\n', start, end), out.rfind(b'\r', start, end)) + 1
+        if out[max(bol, start):end].strip() != prompt:
+          break
+        end = bol
+    while end > start and out[end - 1:end].isspace():
+      end -= 1
+
+    body = out[start:end]
+    if b'\r' in body:
+      body = body.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return to_text(body, errors='surrogate_or_strict').strip()
+
+
+  def pipeline_commands(self, commands):
+    """Send a window of commands at once and split the output by prompt and echo boundaries
+
+    The device buffers the commands typed ahead and runs them one by one,
+    so the output of a command ends with the prompt followed by the echo of the next command.
+      router#show version
+      ...
+      router#show ip int brief
+      ...
+      router#
+    Use this only for commands without prompt and answer.
+    """
+    tn = self.get_connection()
+    if tn is None:
+      return
+
+    command_timeout = self.command_timeout()
+    prompt = to_bytes(self.prompt)
+
+    try:
+      start = monotonic()
+      counters = (tn.bytes_received, tn.recv_calls)
+      for command in commands:
+        self.send_command(command)
+
+      responses = list()
+      for i, command in enumerate(commands):
+        if i < len(commands) - 1:
+          # the prompt followed by the echo of the next command
+          index, match, out = self.expect(pipeline_boundary(prompt, commands[i+1]), command_timeout)
+          if index < 0:
+            self.close_connection()
+            raise Exception('Failed to expect prompts: %s' % command)
+          matched_prompt = self.prompt
+          out = out[:len(out) - len(match.group())]
+        else:
+          index, match, out = self.expect(self.command_prompts, command_timeout)
+          if index < 0:
+            self.close_connection()
+            raise Exception('Failed to expect prompts: %s' % command)
+          matched_prompt = self.match_prompt(match)
+        self.add_raw_outputs(out)
+        # time to prompt is counted from the window was sent
+        self.add_command_timing(command, start, counters, ttfb=self.ttfb() if i == 0 else None)
+        counters = (tn.bytes_received, tn.recv_calls)
+        responses.append(self.clean_output(command, matched_prompt, out))
+
+      return responses
 
     except EOFError as e:
       self.close_connection()
       raise Exception('Telnet action failed: %s' % to_text(e))
 
 
-  def run_commands(self):
+  def stream_and_wait(self, command, stream_to):
+    """wait for prompt, writing the output to stream_to"""
+    spool = OutputSpool(stream_to, command)
+    try:
+      index, match, out = self.expect(self.command_prompts, self.command_timeout(), sink=spool.write)
+      if index < 0:
+        self.close_connection()
+        raise Exception('Failed to expect prompts: %s' % command)
+      self.match_prompt(match)
+      self.add_raw_outputs(out)
+      spool.write(out[:len(out) - len(match.group())])
+    finally:
+      result = spool.close()
+    return result
+
+
+  def pacing_delay(self):
+    """seconds to wait before sending the next command
+
+    fixed: always wait pause seconds
+    prompt: do not wait, the prompt has already been received
+    adaptive: wait a ratio of the median prompt latency seen so far, up to pause seconds
+    """
+    pacing = self.pacing()
+    if pacing == 'fixed':
+      return self.pause()
+    if pacing == 'adaptive' and self.prompt_latencies:
+      latencies = sorted(self.prompt_latencies)
+      return min(self.pause(), latencies[len(latencies) // 2] * self.ADAPTIVE_PACING_RATIO)
+    return 0
+
+
+  def pipeline_window_at(self, parsed, i):
+    """commands to be pipelined from parsed[i], up to pipeline_window commands without prompt, answer and stream_to
+
+    The window ends at the first command not matching pipeline_allow,
+    a command changing the prompt (configure terminal, end ...) would never match the boundary of the window.
+    """
+    window = list()
+    if not self.pipeline() or not self.prompt:
+      return window
+    for command, prompt, answer, stream_to in parsed[i:i + self.pipeline_window()]:
+      if prompt or answer is not None or stream_to or not self._pipeline_allow.search(command):
+        break
+      window.append(command)
+    return window
+
+
+  def run_commands(self, cached=None):
+    """run the commands, cached is dict of the outputs served from the cache keyed by the index of the command"""
     commands = self.commands()
     commands = to_list(commands)
     pause = self.pause()
+    cached = cached or dict()
 
-    responses = list()
-    for i, cmd in enumerate(commands):
+    parsed = list()
+    for index, cmd in enumerate(commands):
+      if index in cached:
+        continue
       if isinstance(cmd, dict):
-        command = cmd.get('command', '')
-        prompt = cmd.get('prompt', None)
-        answer = cmd.get('answer', None)
+        parsed.append((cmd.get('command', ''), cmd.get('prompt', None), cmd.get('answer', None), cmd.get('stream_to', None)))
       else:
-        command = cmd
-        prompt = None
-        answer = None
+        parsed.append((cmd, None, None, None))
 
-      out = self.send_and_wait(command, prompt=prompt, answer=answer)
-      responses.append(out)
+    slept = 0
+    responses = list()
+    i = 0
+    while i < len(parsed):
+      window = self.pipeline_window_at(parsed, i)
+      if len(window) > 1:
+        outs = self.pipeline_commands(window)
+        i += len(window)
+      else:
+        command, prompt, answer, stream_to = parsed[i]
+        outs = [self.send_and_wait(command, prompt=prompt, answer=answer, stream_to=stream_to)]
+        i += 1
+      for out in outs:
+        self.log_response(out)
+      responses.extend(outs)
+
+      if i != len(parsed):
+        delay = self.pacing_delay()
+        if delay > 0:
+          sleep(delay)
+          slept += delay
+
+    self.timing_data['pause_time'] = round(slept, 4)
+
+    # compared with the fixed pause between each command
+    self.pacing_result = {
+      'pacing': self.pacing(),
+      'pause_time': round(slept, 3),
+      'saved_time': round(pause * max(0, len(parsed) - 1) - slept, 3)
+    }
 
-      if i != len(commands) -1:
-        sleep(pause)
+    if cached:
+      run = iter(responses)
+      responses = [cached[index] if index in cached else next(run) for index in range(len(commands))]
 
     return responses
 
@@ -504,42 +1370,308 @@ class TelnetClient(object):
       'changed': False
     }
 
+    # every output is fresh in the cache, no need to connect
+    cached = self.cached_outputs()
+    if cached and len(cached) == len(to_list(self.commands())):
+      result.update(self.command_result([cached[index] for index in range(len(cached))]))
+      return result
+
     login_result = self.login()
     if login_result.get('failed'):
       result.update(login_result)
+      if self.timings():
+        result['timings'] = self.timing_data
       return result
 
     try:
-      responses = self.run_commands()
+      self.open_log()
+      responses = self.run_commands(cached)
       self.logout()
     except Exception as e:
       result['msg'] = 'run_commands() failed'
       result['original_message'] = to_text(e)
+      if self.timings():
+        self.update_counters()
+        result['timings'] = self.timing_data
+      if self.session_log is not None:
+        result['log_path'] = self.session_log.path
       return result
+    finally:
+      self.close_log()
+
+    result.update(self.command_result(responses))
+    return result
+
+
+  def result_cache(self):
+    """ResultCache of this host"""
+    if self._result_cache is None:
+      self._result_cache = ResultCache(os.path.expanduser(self.cache_dir()), '%s:%s' % (self.host(), self.port()),
+                                       size=self._cache_size, ttl=self._cache_ttl)
+    return self._result_cache
+
+
+  def cacheable(self, cmd):
+    """True if the output of the command can be served from the cache
+
+    The command matches cache_allow, and has neither prompt nor stream_to.
+    """
+    if isinstance(cmd, dict):
+      if cmd.get('prompt') or cmd.get('stream_to'):
+        return False
+      cmd = cmd.get('command', '')
+    return bool(self._cache_allow.search(cmd))
 
-    result.update({
+
+  def cached_outputs(self):
+    """fresh outputs in the cache, dict keyed by the index of the command
+
+    An output is fresh for max_age seconds of the command, or cache_max_age of the task.
+    """
+    self.cache_hits = dict()
+    if not self.use_cache():
+      return self.cache_hits
+
+    cache = self.result_cache()
+    now = time()
+    for index, cmd in enumerate(to_list(self.commands())):
+      if not self.cacheable(cmd):
+        continue
+      command = cmd.get('command', '') if isinstance(cmd, dict) else cmd
+      max_age = cmd.get('max_age') if isinstance(cmd, dict) and cmd.get('max_age') is not None else self._cache_max_age
+      entry = cache.get(self.network_os(), command)
+      if entry is not None and now - entry.get('stored', 0) < max_age:
+        self.cache_hits[index] = entry.get('output')
+        cache.touch(self.network_os(), command)
+    return self.cache_hits
+
+
+  def store_outputs(self, responses):
+    """store the outputs run in this session to the cache, and mark those served from it used"""
+    outputs = dict()
+    for index, (cmd, response) in enumerate(zip(to_list(self.commands()), responses)):
+      if index in self.cache_hits or not isinstance(response, string_types):
+        continue
+      if self.track_changes() or (self.use_cache() and self.cacheable(cmd)):
+        outputs[cmd.get('command', '') if isinstance(cmd, dict) else cmd] = response
+    if (outputs or self.cache_hits) and not self._check_mode:
+      self.result_cache().update(outputs, self.network_os())
+
+
+  def compare_outputs(self, responses, result):
+    """compare the outputs with the previous run kept in the cache
+
+    changed, changed_commands and diff are set to the result.
+    Returns the responses, with changes_only the changed lines of the changed commands,
+    empty output for the unchanged ones and the whole output for the commands run first time.
+    """
+    cache = self.result_cache()
+    network_os = self.network_os()
+    changed_commands = list()
+    diffs = list()
+    compared = list()
+    for index, (cmd, response) in enumerate(zip(to_list(self.commands()), responses)):
+      command = cmd.get('command', '') if isinstance(cmd, dict) else cmd
+      if not isinstance(response, string_types):
+        # stream_to
+        compared.append(response)
+        continue
+
+      entry = cache.get(network_os, command)
+      if index in self.cache_hits:
+        # served from the cache, the same as the previous run
+        compared.append('' if self.changes_only() else response)
+      elif entry is None:
+        compared.append(response)
+      elif entry.get('sha1') == output_hash(response):
+        compared.append('' if self.changes_only() else response)
+      else:
+        changed_commands.append(command)
+        diffs.append({'prepared': unified_diff(entry.get('output', ''), response, command)})
+        compared.append('\n'.join(changed_lines(entry.get('output', ''), response)) if self.changes_only() else response)
+
+    result['changed'] = bool(changed_commands)
+    result['changed_commands'] = changed_commands
+    if diffs:
+      result['diff'] = diffs
+    return compared
+
+
+  def command_result(self, responses):
+    """make task result from the responses of run_commands()"""
+    result = {
       'failed': False,
-      'stdout': responses,
-      'stdout_lines': list(self.to_lines(responses))
-    })
+      'changed': False
+    }
+
+    # changed is True when an output differs from the previous run
+    outputs = responses
+    if self.track_changes():
+      responses = self.compare_outputs(responses, result)
+    if self.track_changes() or self.use_cache():
+      self.store_outputs(outputs)
+    if self.use_cache():
+      commands = to_list(self.commands())
+      result['cached_commands'] = [commands[index].get('command', '') if isinstance(commands[index], dict) else commands[index]
+                                   for index in sorted(self.cache_hits)]
+
+    # full: stdout and stdout_lines, stdout_only: stdout, lines_only: stdout_lines, summary: summary
+    result_format = self.result_format()
+    if result_format in ('full', 'stdout_only'):
+      result['stdout'] = responses
+    if result_format in ('full', 'lines_only'):
+      result['stdout_lines'] = list(self.to_lines(responses))
+    if result_format == 'summary':
+      result['summary'] = self.to_summary(responses)
+
+    if self.pacing_result:
+      result['pacing'] = self.pacing_result
+
+    if self.timings() and self.timing_data.get('commands'):
+      self.update_counters()
+      result['timings'] = self.timing_data
 
     # for debug purpose
     if self._debug:
       result.update({
-        'prompt_histories': self.prompt_histories,
-        'command_histories': self.command_histories,
-        # 'raw_outputs': tc.raw_outputs
+        'prompt_histories': list(self.prompt_histories),
+        'command_histories': list(self.command_histories),
+        # 'raw_outputs': tc.raw_output_text()
       })
 
-    # store log in result and save to file in action plugin
+    # the log has been written to log_path as the responses arrived
+    # without log_path, store log in result and save to file in action plugin
     # __log__ key will be removed by action plugin
-    if self._log:
+    if self.session_log is not None:
+      result['log_path'] = self.session_log.path
+      if self.session_log.files()[1:]:
+        result['log_files'] = self.session_log.files()
+    elif self._log:
       result.update({
-        '__log__': '\n'.join(responses)
+        '__log__': '\n'.join([self.to_log(r) for r in responses])
       })
 
     return result
 
+  @staticmethod
+  def host_path(path, name):
+    """the host name prefixed to the file name of path"""
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, '%s_%s' % (name, basename))
+
+
+  @classmethod
+  def host_commands(cls, commands, name):
+    """commands for the host, the host name is prefixed to the file name of stream_to"""
+    host_commands = list()
+    for cmd in to_list(commands):
+      if isinstance(cmd, dict) and cmd.get('stream_to'):
+        cmd = dict(cmd, stream_to=cls.host_path(cmd.get('stream_to'), name))
+      host_commands.append(cmd)
+    return host_commands
+
+
+  @classmethod
+  def run_many(cls, hosts, commands, concurrency=DEFAULT_CONCURRENCY, host_timeout=None, **params):
+    """run commands on many hosts concurrently in one process
+
+    hosts is a list of host names or dicts of params which override params for the host,
+    the key 'name' of the dict is used as the key of the results instead of the host.
+    Up to concurrency sessions are run at the same time, each in a thread blocking in expect().
+    A session running longer than host_timeout seconds is aborted.
+
+    Returns dict of process_command() results keyed by the host, with the key 'elapsed' added.
+    """
+    clients = dict()
+    for h in hosts:
+      p = dict(params)
+      if isinstance(h, dict):
+        p.update(h)
+        # the host of the target, never that of params
+        p['host'] = h.get('host') or h.get('name')
+      else:
+        p['host'] = h
+      name = p.pop('name', None) or p.get('host')
+      p['commands'] = cls.host_commands(p.get('commands') or commands, name)
+      # the files written by each session are prefixed with the name of the target
+      for key in ('log_path', 'record_path'):
+        if params.get(key) and p.get(key) == params.get(key):
+          p[key] = cls.host_path(params.get(key), name)
+      clients[name] = cls(p)
+
+    started = dict()
+    timed_out = set()
+
+    def run(name, tc):
+      started[name] = monotonic()
+      # abort() can not interrupt connect(), which must give up within host_timeout by itself
+      if host_timeout and (not tc.connect_timeout() or tc.connect_timeout() > host_timeout):
+        tc.connect_timeout(host_timeout)
+      try:
+        result = tc.process_command()
+      except Exception as e:
+        result = {
+          'failed': True,
+          'changed': False,
+          'msg': 'process_command() failed',
+          'original_message': to_text(e)
+        }
+      finally:
+        tc.close_connection()
+      if name in timed_out:
+        result['failed'] = True
+        result['msg'] = 'host_timeout %s sec exceeded' % host_timeout
+      result['elapsed'] = round(monotonic() - started[name], 3)
+      return result
+
+    results = dict()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+      futures = dict((executor.submit(run, name, tc), name) for name, tc in clients.items())
+      pending = set(futures)
+      while pending:
+        timeout = None
+        if host_timeout:
+          now = monotonic()
+          # the aborted sessions are left out, their deadlines have passed and would make wait() spin
+          deadlines = [started[futures[f]] + host_timeout for f in pending if futures[f] in started and futures[f] not in timed_out]
+          timeout = max(0, min(deadlines) - now) if deadlines else cls.QUIET_TIME
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for f in done:
+          results[futures[f]] = f.result()
+        if host_timeout:
+          now = monotonic()
+          for f in pending:
+            name = futures[f]
+            if name in started and name not in timed_out and now - started[name] >= host_timeout:
+              timed_out.add(name)
+              clients[name].abort()
+
+    return results
+
+
+  @classmethod
+  def process_targets(cls, params):
+    """run_many() for the targets option of the module
+
+    The other params are common to all targets, the params of the target take precedence.
+    """
+    common = dict((k, v) for k, v in params.items() if k not in ('targets', 'commands', 'concurrency', 'host_timeout', 'host') and v is not None)
+    results = cls.run_many(
+      params.get('targets'), params.get('commands'),
+      concurrency=params.get('concurrency') or cls.DEFAULT_CONCURRENCY,
+      host_timeout=params.get('host_timeout'),
+      **common)
+
+    failed = sorted(name for name, r in results.items() if r.get('failed'))
+    result = {
+      'failed': bool(failed),
+      'changed': False,
+      'host_results': results
+    }
+    if failed:
+      result['msg'] = 'failed on %s' % ', '.join(failed)
+    return result
+
 #
 # TEST
 #
@@ -35,9 +35,11 @@ option on one of the read calls only
 import sys
 import socket
 import selectors
+import functools
 from time import monotonic as _time
 
-__all__ = ["Telnet"]
+__all__ = ["Telnet", "expect_window", "combine_patterns", "anchored_at_end",
+           "TranscriptRecorder", "TranscriptReplay", "read_transcript"]
 
 # Tunable parameters
 DEBUGLEVEL = 0
@@ -45,6 +47,21 @@ DEBUGLEVEL = 0
 # Telnet protocol defaults
 TELNET_PORT = 23
 
+# Size of the buffer fill_rawq() receives into.  It starts at RECV_SIZE,
+# doubles while recv() fills it up, up to RECV_SIZE_MAX for a bulk output
+# like cisco show-tech (takamitsu-iida 20190130), and halves when recv()
+# returns less than a quarter of it, down to RECV_SIZE_MIN.
+RECV_SIZE = 16384
+RECV_SIZE_MIN = 4096
+RECV_SIZE_MAX = 262144
+
+# Tail rescanned by expect() in incremental mode when a regular
+# expression can match text of unbounded length
+EXPECT_WINDOW = 1024
+
+# Prefix of the group names combine_patterns() gives to the alternatives
+GROUP_PREFIX = '_expect'
+
 # Telnet protocol characters (don't change)
 IAC  = bytes([255]) # "Interpret As Command"
 DONT = bytes([254])
@@ -52,6 +69,7 @@ DO   = bytes([253])
 WONT = bytes([252])
 WILL = bytes([251])
 theNULL = bytes([0])
+XON  = bytes([17])  # DC1, dropped from the data stream like NUL
 
 SE  = bytes([240])  # Subnegotiation End
 NOP = bytes([241])  # No Operation
@@ -193,26 +211,48 @@ class Telnet:
     """
 
     def __init__(self, host=None, port=0,
-                timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+                timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                recv_size=RECV_SIZE, recv_size_max=RECV_SIZE_MAX, rcvbuf=None):
         """Constructor.
 
         When called without arguments, create an unconnected instance.
         With a hostname argument, it connects the instance; port number
         and timeout are optional.
+
+        recv_size is the initial size of recv(), it adapts to the output
+        up to recv_size_max.  recv_size_max equal to recv_size keeps it
+        fixed.  rcvbuf sets SO_RCVBUF of the socket before connecting.
         """
         self.debuglevel = DEBUGLEVEL
         self.host = host
         self.port = port
         self.timeout = timeout
         self.sock = None
-        self.rawq = b''
+        self.rawq = bytearray()
         self.irawq = 0
-        self.cookedq = b''
+        self.cookedq = bytearray()
+        self.icookedq = 0 # Read offset in cookedq.
+        self.recv_size = recv_size
+        self.recv_size_max = max(recv_size, recv_size_max)
+        if self.recv_size_max == recv_size:
+            self.recv_size_min = recv_size
+        else:
+            self.recv_size_min = min(RECV_SIZE_MIN, recv_size)
+        self.recv_size_peak = recv_size # Largest recv_size reached.
+        self.recvbuf = memoryview(bytearray(recv_size))
+        self.rcvbuf = rcvbuf
         self.eof = 0
         self.iacseq = b'' # Buffer for IAC sequence.
         self.sb = 0 # flag for SB and SE sequence.
         self.sbdataq = b''
         self.option_callback = None
+        self.selector = None # Selector watching the socket, see get_selector().
+        self.recorder = None # TranscriptRecorder, see set_recorder().
+        # Counters for timing and debug.
+        self.bytes_received = 0
+        self.recv_calls = 0
+        self.write_time = None # Time of the last write().
+        self.first_recv_time = None # Time of the first recv() after that.
         if host is not None:
             self.open(host, port, timeout)
 
@@ -230,7 +270,24 @@ class Telnet:
         self.host = host
         self.port = port
         self.timeout = timeout
-        self.sock = socket.create_connection((host, port), timeout)
+        self.sock = _create_connection((host, port), timeout, self.rcvbuf)
+
+    def open_replay(self, path, realtime=False):
+        """Connect to a replay of a transcript instead of a host.
+
+        The data received in the recorded session is played back, see
+        TranscriptReplay.  Don't try to reopen an already connected
+        instance.
+
+        """
+        self.eof = 0
+        self.host = path
+        self.port = 0
+        self.sock = TranscriptReplay(path, realtime=realtime).start()
+
+    def set_recorder(self, recorder):
+        """Record the data sent and received to a TranscriptRecorder, None stops it."""
+        self.recorder = recorder
 
     def __del__(self):
         """Destructor -- close the connection."""
@@ -265,6 +322,9 @@ class Telnet:
         self.eof = True
         self.iacseq = b''
         self.sb = 0
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
         if sock:
             sock.close()
 
@@ -272,6 +332,19 @@ class Telnet:
         """Return the socket object used internally."""
         return self.sock
 
+    def get_selector(self):
+        """Return the selector watching the socket for reading.
+
+        It is created on the first use and kept until close(), instead
+        of building and registering a new one on every read call.
+
+        """
+        if self.selector is None:
+            selector = _TelnetSelector()
+            selector.register(self, selectors.EVENT_READ)
+            self.selector = selector
+        return self.selector
+
     def fileno(self):
         """Return the fileno() of the socket object used internally."""
         return self.sock.fileno()
@@ -286,7 +359,9 @@ class Telnet:
         if IAC in buffer:
             buffer = buffer.replace(IAC, IAC+IAC)
         self.msg("send %r", buffer)
-        self.sock.sendall(buffer)
+        self._sendall(buffer)
+        self.write_time = _time()
+        self.first_recv_time = None
 
     def read_until(self, match, timeout=None):
         """Read until a given string is encountered or until timeout.
@@ -298,31 +373,24 @@ class Telnet:
         """
         n = len(match)
         self.process_rawq()
-        i = self.cookedq.find(match)
+        i = self.cookedq.find(match, self.icookedq)
         if i >= 0:
-            i = i+n
-            buf = self.cookedq[:i]
-            self.cookedq = self.cookedq[i:]
-            return buf
+            return self._read_cookedq(i+n)
         if timeout is not None:
             deadline = _time() + timeout
-        with _TelnetSelector() as selector:
-            selector.register(self, selectors.EVENT_READ)
-            while not self.eof:
-                if selector.select(timeout):
-                    i = max(0, len(self.cookedq)-n)
-                    self.fill_rawq()
-                    self.process_rawq()
-                    i = self.cookedq.find(match, i)
-                    if i >= 0:
-                        i = i+n
-                        buf = self.cookedq[:i]
-                        self.cookedq = self.cookedq[i:]
-                        return buf
-                if timeout is not None:
-                    timeout = deadline - _time()
-                    if timeout < 0:
-                        break
+        selector = self.get_selector()
+        while not self.eof:
+            if selector.select(timeout):
+                i = max(0, len(self.cookedq)-self.icookedq-n)
+                self.fill_rawq()
+                self.process_rawq()
+                i = self.cookedq.find(match, self.icookedq+i)
+                if i >= 0:
+                    return self._read_cookedq(i+n)
+            if timeout is not None:
+                timeout = deadline - _time()
+                if timeout < 0:
+                    break
         return self.read_very_lazy()
 
     def read_all(self):
@@ -331,9 +399,7 @@ class Telnet:
         while not self.eof:
             self.fill_rawq()
             self.process_rawq()
-        buf = self.cookedq
-        self.cookedq = b''
-        return buf
+        return self._read_cookedq()
 
     def read_some(self):
         """Read at least one byte of cooked data unless EOF is hit.
@@ -346,9 +412,7 @@ class Telnet:
         while not self.cookedq and not self.eof:
             self.fill_rawq()
             self.process_rawq()
-        buf = self.cookedq
-        self.cookedq = b''
-        return buf
+        return self._read_cookedq()
 
     def read_very_eager(self):
         """Read everything that's possible without blocking in I/O (eager).
@@ -396,12 +460,31 @@ class Telnet:
         Return b'' if no cooked data available otherwise.  Don't block.
 
         """
-        buf = self.cookedq
-        self.cookedq = b''
+        buf = self._read_cookedq()
         if not buf and self.eof and not self.rawq:
             raise EOFError('telnet connection closed')
         return buf
 
+    def _read_cookedq(self, end=None):
+        """Remove and return the cooked data up to end (default all) as bytes.
+
+        Only the read offset moves here.  The consumed bytes are dropped
+        by process_rawq() once they make up half of the queue, or at once
+        when the queue has been read up completely.
+
+        """
+        cookedq = self.cookedq
+        if end is None or end > len(cookedq):
+            end = len(cookedq)
+        with memoryview(cookedq) as view:
+            buf = view[self.icookedq:end].tobytes()
+        if end == len(cookedq):
+            del cookedq[:]
+            self.icookedq = 0
+        else:
+            self.icookedq = end
+        return buf
+
     def read_sb_data(self):
         """Return any data available in the SB ... SE queue.
 
@@ -424,71 +507,100 @@ class Telnet:
         Set self.eof when connection is closed.  Don't block unless in
         the midst of an IAC sequence.
 
+        The raw queue is decoded a span at a time: data between two IAC
+        bytes is located with bytes.find() and copied as one slice, and
+        only the IAC sequences themselves are walked byte by byte.  An
+        IAC sequence split across recv() calls stays in self.iacseq and
+        is completed on the next call.
+
         """
-        buf = [b'', b'']
-        try:
-            while self.rawq:
-                c = self.rawq_getchar()
-                if not self.iacseq:
-                    if c == theNULL:
-                        continue
-                    if c == b"\021":
-                        continue
-                    if c != IAC:
-                        buf[self.sb] = buf[self.sb] + c
-                        continue
+        rawq = self.rawq
+        i = self.irawq
+        end = len(rawq)
+        self.rawq = bytearray()
+        self.irawq = 0
+        if self.icookedq and self.icookedq >= len(self.cookedq) - self.icookedq:
+            del self.cookedq[:self.icookedq]
+            self.icookedq = 0
+        buf = [self.cookedq, []]
+        view = memoryview(rawq)
+        while i < end:
+            if not self.iacseq:
+                j = rawq.find(IAC, i, end)
+                if j < 0:
+                    j = end
+                if j > i:
+                    if rawq.find(theNULL, i, j) >= 0 or rawq.find(XON, i, j) >= 0:
+                        data = bytes(view[i:j]).translate(None, theNULL + XON)
                     else:
-                        self.iacseq += c
-                elif len(self.iacseq) == 1:
-                    # 'IAC: IAC CMD [OPTION only for WILL/WONT/DO/DONT]'
-                    if c in (DO, DONT, WILL, WONT):
-                        self.iacseq += c
-                        continue
-
-                    self.iacseq = b''
-                    if c == IAC:
-                        buf[self.sb] = buf[self.sb] + c
+                        data = view[i:j]
+                    if self.sb:
+                        buf[1].append(bytes(data))
                     else:
-                        if c == SB: # SB ... SE start.
-                            self.sb = 1
-                            self.sbdataq = b''
-                        elif c == SE:
-                            self.sb = 0
-                            self.sbdataq = self.sbdataq + buf[1]
-                            buf[1] = b''
-                        if self.option_callback:
-                            # Callback is supposed to look into
-                            # the sbdataq
-                            self.option_callback(self.sock, c, NOOPT)
-                        else:
-                            # We can't offer automatic processing of
-                            # suboptions. Alas, we should not get any
-                            # unless we did a WILL/DO before.
-                            self.msg('IAC %d not recognized' % ord(c))
-                elif len(self.iacseq) == 2:
-                    cmd = self.iacseq[1:2]
-                    self.iacseq = b''
-                    opt = c
-                    if cmd in (DO, DONT):
-                        self.msg('IAC %s %d',
-                            cmd == DO and 'DO' or 'DONT', ord(opt))
-                        if self.option_callback:
-                            self.option_callback(self.sock, cmd, opt)
-                        else:
-                            self.sock.sendall(IAC + WONT + opt)
-                    elif cmd in (WILL, WONT):
-                        self.msg('IAC %s %d',
-                            cmd == WILL and 'WILL' or 'WONT', ord(opt))
-                        if self.option_callback:
-                            self.option_callback(self.sock, cmd, opt)
-                        else:
-                            self.sock.sendall(IAC + DONT + opt)
-        except EOFError: # raised by self.rawq_getchar()
-            self.iacseq = b'' # Reset on EOF
-            self.sb = 0
-            pass
-        self.cookedq = self.cookedq + buf[0]
-        self.sbdataq = self.sbdataq + buf[1]
+                        buf[0] += data
+                if j == end:
+                    break
+                self.iacseq = IAC
+                i = j + 1
+                continue
+
+            c = bytes(view[i:i+1])
+            i = i + 1
+            if len(self.iacseq) == 1:
+                # 'IAC: IAC CMD [OPTION only for WILL/WONT/DO/DONT]'
+                if c in (DO, DONT, WILL, WONT):
+                    self.iacseq += c
+                    continue
+
+                self.iacseq = b''
+                if c == IAC:
+                    if self.sb:
+                        buf[1].append(c)
+                    else:
+                        buf[0] += c
+                else:
+                    if c == SB: # SB ... SE start.
+                        self.sb = 1
+                        self.sbdataq = b''
+                    elif c == SE:
+                        self.sb = 0
+                        self.sbdataq = self.sbdataq + b''.join(buf[1])
+                        buf[1] = []
+                    if self.option_callback:
+                        # Callback is supposed to look into
+                        # the sbdataq
+                        self.option_callback(self.sock, c, NOOPT)
+                    else:
+                        # We can't offer automatic processing of
+                        # suboptions. Alas, we should not get any
+                        # unless we did a WILL/DO before.
+                        self.msg('IAC %d not recognized' % ord(c))
+            elif len(self.iacseq) == 2:
+                cmd = self.iacseq[1:2]
+                self.iacseq = b''
+                opt = c
+                if cmd in (DO, DONT):
+                    self.msg('IAC %s %d',
+                        cmd == DO and 'DO' or 'DONT', ord(opt))
+                    if self.option_callback:
+                        self.option_callback(self.sock, cmd, opt)
+                    else:
+                        self._sendall(IAC + WONT + opt)
+                elif cmd in (WILL, WONT):
+                    self.msg('IAC %s %d',
+                        cmd == WILL and 'WILL' or 'WONT', ord(opt))
+                    if self.option_callback:
+                        self.option_callback(self.sock, cmd, opt)
+                    else:
+                        self._sendall(IAC + DONT + opt)
+        view.release()
+        self.sbdataq = self.sbdataq + b''.join(buf[1])
+
+    def _sendall(self, buffer):
+        """Send the buffer to the socket, recording it if a recorder is set."""
+        self.sock.sendall(buffer)
+        if self.recorder is not None:
+            self.recorder.record_send(buffer)
 
     def rawq_getchar(self):
         """Get next char from raw queue.
@@ -498,39 +610,67 @@ class Telnet:
 
         """
         if not self.rawq:
-            self.fill_rawq()
+            self.fill_rawq(raw=True)
             if self.eof:
                 raise EOFError
-        c = self.rawq[self.irawq:self.irawq+1]
+        c = bytes(self.rawq[self.irawq:self.irawq+1])
         self.irawq = self.irawq + 1
         if self.irawq >= len(self.rawq):
-            self.rawq = b''
+            self.rawq = bytearray()
             self.irawq = 0
         return c
 
-    def fill_rawq(self):
+    def fill_rawq(self, raw=False):
         """Fill raw queue from exactly one recv() system call.
 
         Block if no data is immediately available.  Set self.eof when
         connection is closed.
 
+        When nothing is left in the raw queue and no IAC sequence is
+        pending, data without IAC, NUL and XON bytes needs no decoding,
+        so it is appended to the cooked queue straight from the receive
+        buffer and process_rawq() has nothing to do.  Most of the output
+        after the option negotiation takes this path.  raw=True always
+        fills the raw queue.
+
         """
         if self.irawq >= len(self.rawq):
-            self.rawq = b''
+            self.rawq = bytearray()
             self.irawq = 0
-        # The buffer size should be fairly small so as to avoid quadratic
-        # behavior in process_rawq() above
-        # buf = self.sock.recv(50)
-        buf = self.sock.recv(15000)  # fixed by takamitsu-iida 20190130, this shoud be large enough to receive cisco show-tech output.
-        self.msg("recv %r", buf)
-        self.eof = (not buf)
-        self.rawq = self.rawq + buf
+        # Receive into the buffer allocated in the constructor instead of
+        # a new bytes object for every recv().
+        n = self.sock.recv_into(self.recvbuf)
+        if self.debuglevel > 0:
+            self.msg("recv %r", self.recvbuf[:n].tobytes())
+        if self.recorder is not None:
+            self.recorder.record_recv(self.recvbuf[:n])
+        self.eof = (not n)
+        recvbytes = self.recvbuf.obj
+        if (raw or self.rawq or self.iacseq or self.sb
+                or recvbytes.find(IAC, 0, n) >= 0
+                or recvbytes.find(theNULL, 0, n) >= 0
+                or recvbytes.find(XON, 0, n) >= 0):
+            self.rawq += self.recvbuf[:n]
+        else:
+            self.cookedq += self.recvbuf[:n]
+        self.recv_calls += 1
+        self.bytes_received += n
+        if n and self.first_recv_time is None:
+            self.first_recv_time = _time()
+        if n == self.recv_size and n < self.recv_size_max:
+            self.set_recv_size(min(n * 2, self.recv_size_max))
+        elif n and n < self.recv_size // 4 and self.recv_size > self.recv_size_min:
+            self.set_recv_size(max(self.recv_size // 2, self.recv_size_min))
+
+    def set_recv_size(self, size):
+        """Change the size of recv() in fill_rawq()."""
+        self.recv_size = size
+        self.recv_size_peak = max(self.recv_size_peak, size)
+        self.recvbuf = memoryview(bytearray(size))
 
     def sock_avail(self):
         """Test whether data is available on the socket."""
-        with _TelnetSelector() as selector:
-            selector.register(self, selectors.EVENT_READ)
-            return bool(selector.select(0))
+        return bool(self.get_selector().select(0))
 
     def interact(self):
         """Interaction function, emulates a very dumb telnet client."""
@@ -581,7 +721,7 @@ class Telnet:
             else:
                 sys.stdout.flush()
 
-    def expect(self, list, timeout=None):
+    def expect(self, list, timeout=None, window=None, sink=None):
         """Read until one from a list of a regular expressions matches.
 
         The first argument is a list of regular expressions, either
@@ -602,6 +742,29 @@ class Telnet:
         or if more than one expression can match the same input, the
         results are undeterministic, and may depend on the I/O timing.
 
+        The optional third argument turns on incremental matching.  The
+        whole cooked queue is searched once, and after that each search
+        starts window bytes before the end of the text already searched,
+        so a large output is not rescanned from the beginning on every
+        recv().  window must be at least the length of the longest text
+        the regular expressions can match, see expect_window().  The
+        results are the same as a full search for expressions that don't
+        use '^' or lookbehind to look further back than window.  The
+        expressions anchored at the end of the text ('$' without
+        MULTILINE) are searched only in the last window bytes, since
+        their match can not end anywhere else.
+
+        The regular expressions are searched in place on the cooked
+        queue.  Only when one matches, the part of the cooked queue being
+        scanned is copied for the match object returned, so the offsets
+        of the match object are relative to that part.
+
+        If a callable sink is given together with window, the text that
+        has moved out of the window is taken off the cooked queue and
+        passed to sink() as it arrives, and the returned text only holds
+        the rest.  The memory used does not depend on the size of the
+        output then.
+
         """
         re = None
         list = list[:]
@@ -610,33 +773,164 @@ class Telnet:
             if not hasattr(list[i], "search"):
                 if not re: import re
                 list[i] = re.compile(list[i])
+        if window is not None:
+            tails = [anchored_at_end(pattern) for pattern in list]
+        else:
+            tails = [False] * len(list)
         if timeout is not None:
             deadline = _time() + timeout
-        with _TelnetSelector() as selector:
-            selector.register(self, selectors.EVENT_READ)
-            while not self.eof:
-                self.process_rawq()
+            selector = self.get_selector()
+        pos = 0
+        while not self.eof:
+            self.process_rawq()
+            start = self.icookedq + pos
+            found = None
+            with memoryview(self.cookedq) as view:
+                scanned = view[start:]
                 for i in indices:
-                    m = list[i].search(self.cookedq)
-                    if m:
-                        e = m.end()
-                        text = self.cookedq[:e]
-                        self.cookedq = self.cookedq[e:]
-                        return (i, m, text)
-                if timeout is not None:
-                    ready = selector.select(timeout)
-                    timeout = deadline - _time()
-                    if not ready:
-                        if timeout < 0:
-                            break
-                        else:
-                            continue
-                self.fill_rawq()
+                    # '$' also matches before a newline at the end
+                    begin = max(0, len(scanned) - window - 1) if tails[i] else 0
+                    if list[i].search(scanned, begin):
+                        found = i
+                        break
+                scanned.release()
+            if found is not None:
+                # the match object must not refer to the cooked queue,
+                # which is resized while the match is still in use
+                with memoryview(self.cookedq) as view:
+                    text = view[start:].tobytes()
+                m = list[found].search(text, begin)
+                text = self._read_cookedq(start + m.end())
+                return (found, m, text)
+            if window is not None:
+                pos = max(0, len(self.cookedq) - self.icookedq - window)
+                if sink is not None and pos:
+                    sink(self._read_cookedq(self.icookedq + pos))
+                    pos = 0
+            if timeout is not None:
+                ready = selector.select(timeout)
+                timeout = deadline - _time()
+                if not ready:
+                    if timeout < 0:
+                        break
+                    else:
+                        continue
+            self.fill_rawq()
         text = self.read_very_lazy()
         if not text and self.eof:
             raise EOFError
         return (-1, None, text)
 
+    def expect_any(self, list, timeout=None, window=None, sink=None):
+        """Like expect(), but search all the regular expressions in one pass.
+
+        The list is compiled into one alternation by combine_patterns(),
+        so each chunk is scanned once instead of once per expression.
+        The index of the alternative that matched is returned as the
+        first item of the tuple, the same as expect().
+
+        When more than one expression can match, the one matching at
+        the earliest position wins, and the lowest index among those
+        matching at the same position.  The match object is that of the
+        combined expression, its groups are numbered after the groups
+        of the alternatives.  Falls back to expect() when the list can
+        not be combined.
+
+        Note that the re module searches a literal prefix much faster
+        than an alternation, so this is not always faster than expect().
+        See tools/bench_telnetlib.py alternation.
+
+        """
+        combined = combine_patterns(tuple(list))
+        if combined is None:
+            return self.expect(list, timeout, window, sink)
+        index, m, text = self.expect([combined], timeout, window, sink)
+        if m is not None:
+            index = int(m.lastgroup[len(GROUP_PREFIX):])
+        return (index, m, text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def _sre_parse():
+    """Return the regular expression parser, re._parser since Python 3.11."""
+    try:
+        from re import _parser as sre_parse
+    except ImportError:
+        import sre_parse # pylint: disable=deprecated-module
+    return sre_parse
+
+
+def expect_window(list, limit=EXPECT_WINDOW):
+    """Return the window Telnet.expect() needs for a list of regular expressions.
+
+    This is the length of the longest text any of them can match, or
+    limit when that is larger or unbounded (e.g. '\\w+').
+
+    """
+    import re
+    sre_parse = _sre_parse()
+    width = 0
+    for pattern in list:
+        if not hasattr(pattern, "search"):
+            pattern = re.compile(pattern)
+        width = max(width, sre_parse.parse(pattern.pattern, pattern.flags).getwidth()[1])
+        if width >= limit:
+            return limit
+    return width
+
+
+class TranscriptRecorder:
+
+    """Record the byte stream of a Telnet connection to a JSONL file.
+
+    The first line is a header with the version, the start time and the
+    optional meta dict.  Each following line is an event with the
+    seconds since the start, {"t": 0.0123, "op": "recv", "data": base64}
+    for the data received including the telnet commands, and
+    {"t": ..., "op": "send", "n": 5} for the data sent.  Only the size of
+    the data sent is recorded, so passwords are never written.  An empty
+    recv is the end of file.  A path ending with .gz is compressed.
+
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, meta=None):
+        import gzip
+        import json
+        import time
+        self._json = json
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, 'wt', encoding='ascii')
+        else:
+            self.file = open(path, 'w', encoding='ascii')
+        self.start = _time()
+        self._write({'version': self.VERSION, 'started': time.time(), 'meta': meta or {}})
+
+    def _write(self, obj):
+        self.file.write(self._json.dumps(obj, separators=(',', ':')) + '\n')
+
+    def record_recv(self, data):
+        """Record the data received, b'' at the end of file."""
+        import base64
+        self._write({'t': round(_time() - self.start, 6), 'op': 'recv',
+                     'data': base64.b64encode(data).decode('ascii')})
+
+    def record_send(self, data):
+        """Record the size of the data sent."""
+        self._write({'t': round(_time() - self.start, 6), 'op': 'send', 'n': len(data)})
+
+    def close(self):
+        """Close the transcript file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
     def __enter__(self):
         return self
 
@@ -644,6 +938,222 @@ class Telnet:
         self.close()
 
 
+def read_transcript(path):
+    """Read a file of TranscriptRecorder.
+
+    Return (header, events), events is a list of (t, op, value), value
+    is the bytes received for "recv" and the number of bytes sent for
+    "send".
+
+    """
+    import base64
+    import gzip
+    import json
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='ascii') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != TranscriptRecorder.VERSION:
+            raise ValueError('unsupported transcript version %r' % header.get('version'))
+        events = []
+        for line in f:
+            event = json.loads(line)
+            if event['op'] == 'recv':
+                events.append((event['t'], 'recv', base64.b64decode(event['data'])))
+            else:
+                events.append((event['t'], event['op'], event['n']))
+    return header, events
+
+
+class TranscriptReplay:
+
+    """Play back a transcript of TranscriptRecorder over a socket pair.
+
+    start() returns the socket for Telnet, a thread sends the recorded
+    data to the other end.  Before the data following a "send" event, it
+    waits until the client has sent as many bytes, so the output never
+    arrives before the command.  With realtime, the data is delayed as
+    in the recorded session, counted from the send before it.
+    Otherwise it is sent as fast as possible, for profiling the client
+    without network.
+
+    The data sent is matched by its size only.  When the client sends
+    less than recorded, e.g. a shorter password, the playback goes on
+    SEND_QUIET seconds after the last byte, or send_timeout seconds
+    when nothing is sent.
+
+    """
+
+    SEND_QUIET = 0.05
+
+    def __init__(self, path, realtime=False, send_timeout=5.0):
+        self.header, self.events = read_transcript(path)
+        self.realtime = realtime
+        self.send_timeout = send_timeout
+        self.credit = 0 # Bytes received from the client ahead of the transcript.
+        self.thread = None
+        self.sock = None
+
+    def start(self):
+        """Start the playback thread and return the socket for Telnet."""
+        import threading
+        client, self.sock = socket.socketpair()
+        self.thread = threading.Thread(target=self._play, name='TranscriptReplay')
+        self.thread.daemon = True
+        self.thread.start()
+        return client
+
+    def _receive(self, n):
+        """Wait until the client has sent n bytes, False when it is closed."""
+        need = n - self.credit
+        self.credit = 0
+        if need <= 0:
+            self.credit = -need
+            return True
+        self.sock.settimeout(self.send_timeout)
+        try:
+            while need > 0:
+                data = self.sock.recv(65536)
+                if not data:
+                    return False
+                need -= len(data)
+                self.sock.settimeout(self.SEND_QUIET)
+        except socket.timeout:
+            return True
+        self.credit = -need
+        return True
+
+    def _play(self):
+        import time
+        sock = self.sock
+        base = _time()
+        try:
+            for t, op, value in self.events:
+                if op == 'send':
+                    if not self._receive(value):
+                        return
+                    # the device responds to the data just received
+                    base = _time() - t
+                elif op == 'recv':
+                    if not value:
+                        break
+                    if self.realtime:
+                        delay = base + t - _time()
+                        if delay > 0:
+                            time.sleep(delay)
+                    sock.settimeout(None)
+                    sock.sendall(value)
+            # end of the transcript, the device closes the connection
+            sock.shutdown(socket.SHUT_WR)
+            sock.settimeout(self.send_timeout)
+            while sock.recv(65536):
+                pass
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    def join(self, timeout=None):
+        """Wait until the playback thread ends."""
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def _create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, rcvbuf=None):
+    """socket.create_connection() which sets SO_RCVBUF before connect().
+
+    The buffer must be set before connecting for the TCP window scale
+    offered in SYN to cover it.
+
+    """
+    if not rcvbuf:
+        return socket.create_connection(address, timeout)
+    host, port = address
+    err = None
+    for af, socktype, proto, _, sa in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        sock = None
+        try:
+            sock = socket.socket(af, socktype, proto)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            sock.connect(sa)
+            return sock
+        except OSError as e:
+            err = e
+            if sock is not None:
+                sock.close()
+    if err is not None:
+        raise err
+    raise OSError("getaddrinfo returns an empty list")
+
+
+@functools.lru_cache(maxsize=128)
+def anchored_at_end(pattern):
+    """Return True if a compiled regular expression can only match at the end of the text."""
+    import re
+    sre_parse = _sre_parse()
+    if pattern.flags & re.MULTILINE:
+        return False
+
+    def at_end(parsed):
+        if not parsed:
+            return False
+        op, av = parsed[len(parsed) - 1]
+        if op is sre_parse.AT:
+            return av in (sre_parse.AT_END, sre_parse.AT_END_STRING)
+        if op is sre_parse.BRANCH:
+            return all(at_end(branch) for branch in av[1])
+        if op is sre_parse.SUBPATTERN:
+            return at_end(av[-1])
+        return False
+
+    return at_end(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+@functools.lru_cache(maxsize=128)
+def combine_patterns(patterns):
+    """Compile a tuple of regular expressions into one alternation.
+
+    Each expression becomes a named group GROUP_PREFIX + its index, so
+    match.lastgroup tells which one matched.  Return None when there
+    are less than two expressions, or when they can not be combined
+    without changing their meaning: mixed str and bytes, different
+    flags, or backreferences by group number.
+
+    """
+    import re
+    if len(patterns) < 2:
+        return None
+    compiled = []
+    for pattern in patterns:
+        if not hasattr(pattern, "search"):
+            pattern = re.compile(pattern)
+        compiled.append(pattern)
+    flags = compiled[0].flags
+    source = compiled[0].pattern
+    if isinstance(source, bytes):
+        group, sep, backref = b'(?P<%s%d>%s)', b'|', re.compile(br'\\[1-9]')
+        prefix = GROUP_PREFIX.encode('ascii')
+    else:
+        group, sep, backref = '(?P<%s%d>%s)', '|', re.compile(r'\\[1-9]')
+        prefix = GROUP_PREFIX
+    alternatives = []
+    for i, pattern in enumerate(compiled):
+        if type(pattern.pattern) is not type(source) or pattern.flags != flags:
+            return None
+        if backref.search(pattern.pattern):
+            return None
+        alternatives.append(group % (prefix, i, pattern.pattern))
+    try:
+        combined = re.compile(sep.join(alternatives), flags)
+    except re.error:
+        return None
+    # an inline flag like (?i) would apply to all the alternatives
+    if combined.flags != flags:
+        return None
+    return combined
+
+
 def test():
     """Test program for telnetlib.
 
@@ -26,6 +26,15 @@ options:
   commands:
     description:
       - List of commands to be executed over the telnet session.
+      - Each item is a command string or a dict with the keys C(command), C(prompt), C(answer), C(stream_to) and C(max_age).
+      - C(prompt) and C(answer) are used for a command which asks for confirmation.
+      - C(stream_to) is a file path. The output of the command is written to the file as it arrives and
+        only the summary of it is returned, use this for large output like show tech-support.
+        A relative path is placed in the playbook root directory or role root directory.
+        When the task is delegated to a remote host, the file is written on that host,
+        a relative path is relative to the working directory of the module there, and it is not fetched.
+      - C(max_age) is the seconds the output of the command is served from the cache with I(use_cache),
+        instead of I(cache_max_age).
     required: True
 
   network_os:
@@ -36,7 +45,7 @@ options:
   host:
     description:
       - The target host ip address(or DNS name)
-    required: True
+      - Required unless I(targets) is given.
 
   port:
     description:
@@ -77,8 +86,86 @@ options:
 
   pause:
     description:
-      - Seconds to pause between each command issued
-    default: 1
+      - Seconds to pause between each command issued when I(pacing=fixed).
+      - Upper limit of the pause when I(pacing=adaptive).
+      - Defaults to 1 second.
+
+  pacing:
+    description:
+      - How to pace the commands.
+      - C(prompt) sends the next command as soon as the prompt of the previous one is received.
+      - C(fixed) pauses I(pause) seconds between each command, the behavior of the older versions.
+      - C(adaptive) pauses half of the median time the device took to return the prompt, up to I(pause) seconds.
+        Use this for a device which drops the characters typed right after the prompt.
+      - Defaults to C(fixed) when I(pause) is given, otherwise C(prompt).
+    choices: ['prompt', 'fixed', 'adaptive']
+
+  pipeline:
+    description:
+      - Send up to I(pipeline_window) commands at once without waiting for the prompt of each command,
+        and split the output by the prompt and the echo of the next command.
+      - This saves round trips on a high latency link, the device must accept type-ahead.
+      - Only the commands matching I(pipeline_allow) and without C(prompt), C(answer) and C(stream_to) are pipelined,
+        the other commands are run one by one. A command changing the prompt like C(configure terminal)
+        must not be pipelined, the prompt of the window would never be received again.
+    type: bool
+    default: 'false'
+
+  pipeline_window:
+    description:
+      - Number of commands sent at once when I(pipeline=true).
+    type: int
+    default: 8
+
+  pipeline_allow:
+    description:
+      - Regular expression of the read-only commands which can be pipelined with I(pipeline=true).
+    type: str
+    default: '^show '
+
+  recv_size:
+    description:
+      - Initial bytes of one recv() from the socket. It doubles while recv() fills it up, up to I(recv_size_max),
+        and halves when the device returns short replies.
+    type: int
+    default: 16384
+
+  recv_size_max:
+    description:
+      - Upper limit of I(recv_size) for a large output like show tech-support. Set the same value as
+        I(recv_size) to keep the size fixed.
+    type: int
+    default: 262144
+
+  rcvbuf:
+    description:
+      - SO_RCVBUF of the socket in bytes, set before connecting. The OS default is used if not given.
+      - A larger buffer helps to receive a large output over a high latency link.
+    type: int
+
+  retention:
+    description:
+      - How much of the session is kept in memory for debugging, the raw output and the histories of prompts and commands.
+      - C(off) keeps nothing, C(ring) keeps the last I(retention_size) bytes of the output and the last 100 prompts and commands,
+        C(full) keeps everything.
+    choices: ['off', 'ring', 'full']
+    default: ring
+
+  retention_size:
+    description:
+      - Bytes of the output kept when I(retention=ring).
+    type: int
+    default: 65536
+
+  result_format:
+    description:
+      - Keys of the output in the result. C(full) returns C(stdout) and C(stdout_lines),
+        C(stdout_only) returns C(stdout), C(lines_only) returns C(stdout_lines), and C(summary) returns
+        C(summary), the size and the checksum of each output without the output itself.
+      - The output is carried in the result twice with C(full), the other formats make the result smaller
+        for large outputs or many hosts.
+    choices: ['full', 'stdout_only', 'lines_only', 'summary']
+    default: full
 
   log:
     description:
@@ -89,11 +176,142 @@ options:
     type: bool
     default: 'false'
 
+  log_path:
+    description:
+      - Path of the log file. The output of each command is written to the file as soon as it is received,
+        instead of being carried in the result.
+      - The action plugin sets C(log/<inventory_hostname>_<timestamp>.log) in the playbook or role directory
+        when I(log=yes) and this option is not given.
+        A relative path is placed in the playbook or role directory, and when the module runs on a delegated host
+        the file is written to a temporary directory of the host and fetched to that place.
+      - The file name is prefixed with the name of each target when I(targets) is given.
+    type: path
+
+  log_compress:
+    description:
+      - Compress the log file, C(.gz) or C(.zst) is added to the file name.
+        C(zstd) requires the zstandard python library.
+    choices: ['none', 'gzip', 'zstd']
+    default: none
+
+  log_max_size:
+    description:
+      - Rotate the log file when this many bytes (before compression) have been written,
+        the older files are renamed to C(<log_path>.1), C(<log_path>.2) and so on. 0 disables the rotation.
+    type: int
+    default: 0
+
+  log_backups:
+    description:
+      - Number of the rotated log files kept.
+    type: int
+    default: 5
+
+  track_changes:
+    description:
+      - Compare the output of each command with that of the previous run kept in I(cache_dir),
+        and return C(changed) when any of them differs, with the unified diff in C(diff) (shown with --diff).
+      - The output is compared by the sha1 hash, the commands run first time are not changed.
+    type: bool
+    default: 'false'
+
+  changes_only:
+    description:
+      - With I(track_changes), return only the added or changed lines of the changed commands in C(stdout),
+        and an empty output for the unchanged commands. The whole output is returned for the commands run first time.
+    type: bool
+    default: 'false'
+
+  use_cache:
+    description:
+      - Serve the outputs of the read-only commands matching I(cache_allow) from the cache in I(cache_dir)
+        while they are fresh, and store them when they are run.
+        When the outputs of all commands are fresh, the host is not connected.
+      - The commands with C(prompt) or C(stream_to) are always run.
+        It is not used over the persistent connection.
+    type: bool
+    default: 'false'
+
+  cache_max_age:
+    description:
+      - Seconds the output is fresh in the cache with I(use_cache), C(max_age) of the command takes precedence.
+    type: int
+    default: 60
+
+  cache_allow:
+    description:
+      - Regular expression of the read-only commands whose output can be served from the cache.
+    type: str
+    default: '^show '
+
+  cache_dir:
+    description:
+      - Directory of the cache of the outputs, one json file per host keyed by the network os and the command.
+      - The action plugin sets C(cache) in the playbook or role directory when the module runs on the controller,
+        otherwise it is C(~/.ansible/telnet_cache) of the host running the module.
+    type: path
+
+  cache_size:
+    description:
+      - Number of the commands kept in the cache per host, the least recently used ones are evicted. 0 is unlimited.
+    type: int
+    default: 100
+
+  cache_ttl:
+    description:
+      - Seconds the output is kept in the cache since it was stored. 0 keeps it until it is evicted.
+    type: int
+    default: 0
+
+  record_path:
+    description:
+      - Path on the host running the module to record the byte stream of the session, including the telnet commands.
+        The data received and the size of the data sent are written with timestamps in JSONL, C(.gz) compresses it.
+      - The recorded session can be replayed by TelnetClient without network, see tools/bench_client.py.
+      - The file name is prefixed with the name of each target when I(targets) is given.
+    type: path
+
   console:
     description:
       - target device is console server or not.
     type: bool
     default: 'false'
+
+  timings:
+    description:
+      - Return C(timings), seconds spent in each phase of the telnet session.
+    type: bool
+    default: 'false'
+
+  targets:
+    description:
+      - List of target devices to run the commands concurrently in one module execution.
+      - Each item is a dict with the keys C(name), C(host), C(port), C(user), C(password), C(become),
+        C(become_pass) and C(network_os). The keys not given are taken from the options of the task.
+      - The file name of C(stream_to) is prefixed with the name of each target.
+    type: list
+
+  fanout:
+    description:
+      - Build I(targets) from the inventory variables of all hosts in the play batch,
+        and run them in one module execution. Use with C(run_once) and C(delegate_to) a bastion,
+        so that the module is transferred and executed only once instead of once per host.
+      - The result of each host is returned in C(host_results) keyed by inventory_hostname.
+      - This option is handled by the action plugin.
+    type: bool
+    default: 'false'
+
+  concurrency:
+    description:
+      - Maximum number of targets processed at the same time.
+    type: int
+    default: 32
+
+  host_timeout:
+    description:
+      - Seconds allowed for each target, the session running longer than this is aborted.
+      - I(connect_timeout) of each target is capped at this.
+    type: int
 '''
 
 EXAMPLES = '''
@@ -117,6 +335,8 @@ EXAMPLES = '''
             answer: y
           - show run int gig 2
           - show process cpu | inc CPU
+          - command: show tech-support
+            stream_to: log/show_tech.txt
       register: r
 
     - name: show stdout
@@ -127,31 +347,111 @@ EXAMPLES = '''
           {{ s }}
 
           {% endfor %}
+
+- name: execute command on all routers in one module execution on the bastion
+  hosts: routers
+  gather_facts: False
+  tasks:
+    - iida.telnet.command:
+        fanout: true
+        concurrency: 50
+        host_timeout: 120
+        commands:
+          - show version
+      run_once: true
+      delegate_to: bastion
+      register: r
+
+    - name: show stdout of each router
+      debug:
+        var: r.host_results[inventory_hostname].stdout_lines
 '''
 
 RETURN = '''
 stdout:
-  description: The set of responses from the commands
+  description:
+    - The set of responses from the commands
+    - The response of a command with C(stream_to) is a dict with the keys C(stream_to),
+      C(bytes), C(head) and C(tail), head and tail are the first and last 512 bytes of the output.
   type: list
-  returned: always
+  returned: when result_format is full or stdout_only
   sample: [ '...', '...' ]
 
 stdout_lines:
   description: The value of stdout split into a list
   type: list
-  returned: always
+  returned: when result_format is full or lines_only
   sample: [ ['...', '...'], ['...'], ['...'] ]
 
+summary:
+  description:
+    - C(command), C(bytes), C(lines) and C(sha1) of the output of each command.
+    - The summary of a command with C(stream_to) has C(command), C(bytes) and C(stream_to).
+  type: list
+  returned: when result_format is summary
+  sample: [{'command': 'show version', 'bytes': 1234, 'lines': 30, 'sha1': 'da39a3ee5e6b4b0d3255bfef95601890afd80709'}]
+
+pacing:
+  description:
+    - The pacing mode, seconds paused between the commands and seconds saved
+      compared with pausing I(pause) seconds between each command.
+  type: dict
+  returned: when the commands are run in a new telnet session
+  sample: {'pacing': 'prompt', 'pause_time': 0, 'saved_time': 49}
+
+timings:
+  description:
+    - Seconds spent in each phase, C(connect), C(login) (C(login_prompt), C(password_prompt) and C(command_prompt)),
+      C(on_login) terminal setup, C(on_become), C(pause_time) between commands, and total C(bytes_received) and C(recv_calls).
+    - C(recv_size) is the C(initial), C(peak) and C(last) size of recv() and C(rcvbuf) of the socket reported by the OS.
+    - C(commands) is a list of C(command), C(ttfb) (seconds to the first byte), C(time_to_prompt),
+      C(bytes) and C(recv_calls) of each command including the terminal setup.
+  type: dict
+  returned: when timings is yes
+  sample: {'connect': 0.002, 'login': {'login_prompt': 0.01, 'password_prompt': 0.01, 'command_prompt': 0.02},
+           'on_login': 0.05, 'on_become': 0.12, 'pause_time': 0, 'bytes_received': 1234, 'recv_calls': 20,
+           'recv_size': {'initial': 16384, 'peak': 16384, 'last': 4096, 'rcvbuf': 131072},
+           'commands': [{'command': 'show version', 'ttfb': 0.01, 'time_to_prompt': 0.03, 'bytes': 512, 'recv_calls': 2}]}
+
+host_results:
+  description:
+    - The result of each target keyed by the name of the target, when I(targets) or I(fanout) is given.
+      Each result has the same keys as the result of a single host and C(elapsed) seconds.
+  type: dict
+  returned: when targets or fanout is given
+  sample: {'r1': {'failed': false, 'stdout': ['...'], 'stdout_lines': [['...']], 'elapsed': 1.2}}
+
+cached_commands:
+  description: The commands whose output was served from the cache
+  returned: when use_cache is yes
+  type: list
+changed_commands:
+  description: The commands whose output differs from the previous run
+  returned: when track_changes is yes
+  type: list
+diff:
+  description: The unified diff of the output of each changed command against the previous run, in C(prepared)
+  returned: when track_changes is yes and any output is changed
+  type: list
 log_path:
   description: The full path to the log file
   returned: when log is yes
   type: string
+log_files:
+  description: The log file and the rotated log files, the newest first
+  returned: when the log file has been rotated
+  type: list
 '''
 
+import os
+import shutil
+import tempfile
+
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.six import string_types
 
 # import from collection
+from ansible_collections.iida.telnet.plugins.module_utils.telnet_cache import ResultCache
 from ansible_collections.iida.telnet.plugins.module_utils.telnet_util import TelnetClient
 
 
@@ -170,13 +470,26 @@ def main():
   DEFAULT_CONNECT_TIMEOUT = TelnetClient.DEFAULT_CONNECT_TIMEOUT  # 10
   DEFAULT_LOGIN_TIMEOUT = TelnetClient.DEFAULT_LOGIN_TIMEOUT      # 5
   DEFAULT_COMMAND_TIMEOUT = TelnetClient.DEFAULT_COMMAND_TIMEOUT  # 5
-  DEFAULT_PAUSE = TelnetClient.DEFAULT_PAUSE                      # 1
+  DEFAULT_PIPELINE = TelnetClient.DEFAULT_PIPELINE                # False
+  DEFAULT_PIPELINE_WINDOW = TelnetClient.DEFAULT_PIPELINE_WINDOW  # 8
+  DEFAULT_PIPELINE_ALLOW = TelnetClient.DEFAULT_PIPELINE_ALLOW    # ^show
   DEFAULT_CONSOLE = TelnetClient.DEFAULT_CONSOLE                  # False
+  DEFAULT_CONCURRENCY = TelnetClient.DEFAULT_CONCURRENCY          # 32
+  DEFAULT_RECV_SIZE = TelnetClient.DEFAULT_RECV_SIZE              # 16384
+  DEFAULT_RECV_SIZE_MAX = TelnetClient.DEFAULT_RECV_SIZE_MAX      # 262144
+  DEFAULT_RESULT_FORMAT = TelnetClient.DEFAULT_RESULT_FORMAT      # full
+  DEFAULT_RETENTION = TelnetClient.DEFAULT_RETENTION              # ring
+  DEFAULT_RETENTION_SIZE = TelnetClient.DEFAULT_RETENTION_SIZE    # 65536
+  DEFAULT_LOG_BACKUPS = TelnetClient.DEFAULT_LOG_BACKUPS          # 5
+  DEFAULT_CACHE_MAX_AGE = TelnetClient.DEFAULT_CACHE_MAX_AGE      # 60
+  DEFAULT_CACHE_ALLOW = TelnetClient.DEFAULT_CACHE_ALLOW          # ^show
+  DEFAULT_CACHE_SIZE = ResultCache.DEFAULT_SIZE                   # 100
+  DEFAULT_CACHE_TTL = ResultCache.DEFAULT_TTL                     # 0
 
   argument_spec = dict(
     commands=dict(type='list', required=True),
     network_os=dict(default='ios', type='str'),
-    host=dict(type='str', required=True),
+    host=dict(type='str'),
     port=dict(default=23, type='int'),
     user=dict(default="", type='str'),
     password=dict(default="", type='str'),
@@ -185,17 +498,73 @@ def main():
     connect_timeout=dict(default=DEFAULT_CONNECT_TIMEOUT, type='int'),
     login_timeout=dict(default=DEFAULT_LOGIN_TIMEOUT, type='int'),
     command_timeout=dict(default=DEFAULT_COMMAND_TIMEOUT, type='int'),
-    pause=dict(default=DEFAULT_PAUSE, type='int'),
+    # None to tell an explicit pause, which selects fixed pacing, from the default
+    pause=dict(type='int'),
+    pacing=dict(type='str', choices=['prompt', 'fixed', 'adaptive']),
+    pipeline=dict(default=DEFAULT_PIPELINE, type='bool'),
+    pipeline_window=dict(default=DEFAULT_PIPELINE_WINDOW, type='int'),
+    pipeline_allow=dict(default=DEFAULT_PIPELINE_ALLOW, type='str'),
     console=dict(default=DEFAULT_CONSOLE, type='bool'),
+    recv_size=dict(default=DEFAULT_RECV_SIZE, type='int'),
+    recv_size_max=dict(default=DEFAULT_RECV_SIZE_MAX, type='int'),
+    rcvbuf=dict(type='int'),
+    result_format=dict(default=DEFAULT_RESULT_FORMAT, type='str', choices=['full', 'stdout_only', 'lines_only', 'summary']),
+    retention=dict(default=DEFAULT_RETENTION, type='str', choices=['off', 'ring', 'full']),
+    retention_size=dict(default=DEFAULT_RETENTION_SIZE, type='int'),
+    track_changes=dict(default=False, type='bool'),
+    changes_only=dict(default=False, type='bool'),
+    use_cache=dict(default=False, type='bool'),
+    cache_max_age=dict(default=DEFAULT_CACHE_MAX_AGE, type='int'),
+    cache_allow=dict(default=DEFAULT_CACHE_ALLOW, type='str'),
+    cache_dir=dict(type='path'),
+    cache_size=dict(default=DEFAULT_CACHE_SIZE, type='int'),
+    cache_ttl=dict(default=DEFAULT_CACHE_TTL, type='int'),
+    record_path=dict(type='path'),
     log=dict(default=False, type='bool'),
-    debug=dict(default=False, type='bool')
+    log_path=dict(type='path'),
+    log_compress=dict(default='none', type='str', choices=['none', 'gzip', 'zstd']),
+    log_max_size=dict(default=0, type='int'),
+    log_backups=dict(default=DEFAULT_LOG_BACKUPS, type='int'),
+    debug=dict(default=False, type='bool'),
+    timings=dict(default=False, type='bool'),
+    targets=dict(type='list'),
+    concurrency=dict(default=DEFAULT_CONCURRENCY, type='int'),
+    host_timeout=dict(type='int')
   )
 
   # generate module instance
-  module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
-
-  tc = TelnetClient(module.params)
-  result = tc.process_command()
+  module = AnsibleModule(argument_spec=argument_spec, required_one_of=[['host', 'targets']], supports_check_mode=True)
+
+  # relative log_path is written to a temporary directory, the action plugin fetches it
+  # and removes the directory returned in log_tmpdir
+  log_tmpdir = None
+  if module.params.get('log_path') and not os.path.isabs(module.params.get('log_path')):
+    log_tmpdir = tempfile.mkdtemp(prefix='iida_telnet_')
+    module.params['log_path'] = os.path.join(log_tmpdir, module.params.get('log_path'))
+
+  try:
+    if module.params.get('targets'):
+      result = TelnetClient.process_targets(module.params)
+    else:
+      tc = TelnetClient(module.params)
+      result = tc.process_command()
+  except Exception:
+    if log_tmpdir:
+      shutil.rmtree(log_tmpdir, ignore_errors=True)
+    raise
+
+  if log_tmpdir:
+    logged = [r for r in [result] + list((result.get('host_results') or {}).values()) if r.get('log_path')]
+    if logged:
+      result['log_tmpdir'] = log_tmpdir
+    else:
+      # nothing was written, e.g. login failed
+      shutil.rmtree(log_tmpdir, ignore_errors=True)
+
+  # ansible splits stdout of the module into stdout_lines unless it is given,
+  # the action plugin removes this
+  if 'stdout' in result and 'stdout_lines' not in result:
+    result['stdout_lines'] = None
 
   if result.get('failed'):
     module.fail_json(**result)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import re
+
+from ansible.plugins.terminal import TerminalBase
+
+# import from collection
+from ansible_collections.iida.telnet.plugins.module_utils.telnet_util import get_prompt_profile
+
+
+class TerminalModule(TerminalBase):
+  """Prompts and error messages of the devices behind iida.telnet.telnet connection
+
+  Login, terminal setup (terminal length 0 etc.) and privilege escalation are done by
+  TelnetClient when the connection logs in, so on_open_shell() and on_become() do nothing here.
+  """
+
+  # command prompts of the default prompt profile, replaced with those of network_os in __init__()
+  terminal_stdout_re = list(get_prompt_profile('default').command_prompts)
+
+  # error messages of ios and fujitsu sir/srs
+  terminal_stderr_re = [
+    re.compile(br"% ?Error"),
+    re.compile(br"% ?Bad secret"),
+    re.compile(br"[\r\n%] Invalid input detected", re.I),
+    re.compile(br"% ?(?:Incomplete|Ambiguous) command", re.I),
+    re.compile(br"% ?Unknown command", re.I),
+    re.compile(br"[\r\n]% ?Access denied", re.I),
+    re.compile(br"<ERROR>"),
+  ]
+
+
+  def __init__(self, connection):
+    super(TerminalModule, self).__init__(connection)
+    # TelnetClient waits for the command prompts of the same prompt profile after each command
+    self.terminal_stdout_re = list(get_prompt_profile(connection.telnet_params().get('network_os')).command_prompts)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring, broad-except
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+"""Benchmarks of TelnetClient against the fake device (tools/fake_device.py)
+
+The fake device runs in a child process, so the cpu time and memory reported
+here are those of TelnetClient only. ansible must be installed.
+
+  python tools/bench_client.py login --count 50
+  python tools/bench_client.py commands --count 200 --latency 0.02 --pipeline 8
+  python tools/bench_client.py throughput --sizes 1 8 32 --iac-noise 8
+  python tools/bench_client.py throughput --sizes 32 --recv-size 15000 --recv-size-max 15000
+  python tools/bench_client.py record --transcript /tmp/tech.jsonl --tech-size 8 --count 20
+  python tools/bench_client.py replay --transcript /tmp/tech.jsonl --repeat 5 --profile
+  python tools/bench_client.py all
+
+record writes the byte stream of a session to a transcript (TranscriptRecorder of
+module_utils/telnetlib.py), and replay runs TelnetClient over it without network,
+so the client can be profiled against sessions captured from real devices
+(set record_path of TelnetClient to capture them).
+"""
+
+import argparse
+import cProfile
+import importlib.util
+import os
+import pstats
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_UTILS_PATH = os.path.join(HERE, '..', 'plugins', 'module_utils')
+MODULE_UTILS = 'ansible_collections.iida.telnet.plugins.module_utils'
+
+
+def load_telnet_util():
+  """load module_utils/telnet_util.py of this tree, the collection does not need to be installed"""
+  package = ''
+  for name in MODULE_UTILS.split('.'):
+    package = package + '.' + name if package else name
+    if package not in sys.modules:
+      module = types.ModuleType(package)
+      module.__path__ = []
+      sys.modules[package] = module
+
+  for name in ('telnetlib', 'telnet_cache', 'telnet_util'):
+    fullname = MODULE_UTILS + '.' + name
+    spec = importlib.util.spec_from_file_location(fullname, os.path.join(MODULE_UTILS_PATH, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[fullname] = module
+    spec.loader.exec_module(module)
+  return sys.modules[MODULE_UTILS + '.telnet_util']
+
+
+class FakeDeviceProcess(object):
+  """tools/fake_device.py in a child process"""
+
+  def __init__(self, **options):
+    args = [sys.executable, os.path.join(HERE, 'fake_device.py'), '--port', '0']
+    for key, value in options.items():
+      if value is True:
+        args.append('--' + key.replace('_', '-'))
+      elif value not in (None, False):
+        args.extend(['--' + key.replace('_', '-'), str(value)])
+    self.proc = subprocess.Popen(args, stdout=subprocess.PIPE, universal_newlines=True)
+    # fake device listening on 127.0.0.1:12345
+    line = self.proc.stdout.readline()
+    self.host, port = line.split()[-1].rsplit(':', 1)
+    self.port = int(port)
+
+
+  def params(self, **kwargs):
+    params = {
+      'network_os': 'ios',
+      'host': self.host,
+      'port': self.port,
+      'user': 'cisco',
+      'password': 'cisco',
+      'become': True,
+      'become_pass': 'cisco',
+      'command_timeout': 60
+    }
+    params.update(kwargs)
+    return params
+
+
+  def stop(self):
+    self.proc.terminate()
+    self.proc.wait()
+
+
+class Usage(object):
+  """cpu time and memory of this process during the with block"""
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    self.rusage = resource.getrusage(resource.RUSAGE_SELF)
+    return self
+
+
+  def __exit__(self, *_):
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    self.elapsed = time.perf_counter() - self.start
+    self.cpu = (rusage.ru_utime - self.rusage.ru_utime) + (rusage.ru_stime - self.rusage.ru_stime)
+    # ru_maxrss is KB on linux and bytes on macOS
+    self.maxrss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+  def report(self):
+    return 'cpu {0:.3f} sec ({1:.0f}%), max rss {2:.1f} MB'.format(
+      self.cpu, self.cpu / self.elapsed * 100 if self.elapsed else 0, self.maxrss / 1e6)
+
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_login(telnet_util, args):
+  fake = FakeDeviceProcess(network_os=args.network_os, latency=args.latency)
+  try:
+    latencies = []
+    with Usage() as usage:
+      for _ in range(args.count):
+        tc = telnet_util.TelnetClient(fake.params(network_os=args.network_os))
+        start = time.perf_counter()
+        result = tc.login()
+        latencies.append(time.perf_counter() - start)
+        assert not result.get('failed'), result
+        tc.logout()
+  finally:
+    fake.stop()
+
+  print('login: {0} times, network_os {1}, latency {2} sec'.format(args.count, args.network_os, args.latency))
+  print('  mean {0:.1f} ms, p50 {1:.1f} ms, p95 {2:.1f} ms, max {3:.1f} ms'.format(
+    sum(latencies) / len(latencies) * 1e3, percentile(latencies, 50) * 1e3,
+    percentile(latencies, 95) * 1e3, max(latencies) * 1e3))
+  print('  ' + usage.report())
+
+
+def bench_commands(telnet_util, args):
+  fake = FakeDeviceProcess(network_os=args.network_os, latency=args.latency)
+  commands = ['show version'] * args.count
+  try:
+    tc = telnet_util.TelnetClient(fake.params(
+      network_os=args.network_os, commands=commands,
+      pipeline=bool(args.pipeline), pipeline_window=args.pipeline))
+    result = tc.login()
+    assert not result.get('failed'), result
+    with Usage() as usage:
+      responses = tc.run_commands()
+    tc.logout()
+  finally:
+    fake.stop()
+
+  assert len(responses) == args.count and all('uptime' in r for r in responses)
+  print('commands: {0} x show version, latency {1} sec, pipeline window {2}'.format(args.count, args.latency, args.pipeline or 'off'))
+  print('  {0:.3f} sec, {1:.1f} commands/sec'.format(usage.elapsed, args.count / usage.elapsed))
+  print('  ' + usage.report())
+
+
+def bench_throughput(telnet_util, args):
+  print('throughput: show tech-support, iac noise every {0} lines'.format(args.iac_noise or '-'))
+  print('  {0:<8} {1:>8} {2:>10} {3:>10}  {4}'.format('mode', 'MB', 'sec', 'MB/s', 'usage'))
+  for size in args.sizes:
+    nbytes = int(size * 1024 * 1024)
+    fake = FakeDeviceProcess(network_os=args.network_os, tech_size=nbytes, iac_noise=args.iac_noise)
+    try:
+      for mode in ('memory', 'stream'):
+        if mode == 'stream':
+          path = os.path.join(tempfile.mkdtemp(), 'tech.txt')
+          commands = [{'command': 'show tech-support', 'stream_to': path}]
+        else:
+          commands = ['show tech-support']
+        tc = telnet_util.TelnetClient(fake.params(
+          network_os=args.network_os, commands=commands,
+          recv_size=args.recv_size, recv_size_max=args.recv_size_max, rcvbuf=args.rcvbuf))
+        result = tc.login()
+        assert not result.get('failed'), result
+        with Usage() as usage:
+          responses = tc.run_commands()
+        tc.logout()
+        if mode == 'stream':
+          os.remove(path)
+          os.rmdir(os.path.dirname(path))
+        del responses
+        print('  {0:<8} {1:>8} {2:>10.3f} {3:>10.1f}  {4}, {5} recv, peak recv size {6}'.format(
+          mode, size, usage.elapsed, nbytes / usage.elapsed / 1e6, usage.report(),
+          tc.timing_data['recv_calls'], tc.timing_data['recv_size']['peak']))
+    finally:
+      fake.stop()
+
+
+def bench_record(telnet_util, args):
+  fake = FakeDeviceProcess(network_os=args.network_os, latency=args.latency,
+                           tech_size=int(args.tech_size * 1024 * 1024), iac_noise=args.iac_noise)
+  commands = ['show version'] * args.count + ['show tech-support']
+  try:
+    tc = telnet_util.TelnetClient(fake.params(network_os=args.network_os, commands=commands, record_path=args.transcript))
+    result = tc.process_command()
+  finally:
+    fake.stop()
+
+  assert not result.get('failed'), result.get('msg')
+  print('record: {0} x show version and {1} MB show tech-support to {2}, {3} bytes'.format(
+    args.count, args.tech_size, args.transcript, os.path.getsize(args.transcript)))
+
+
+def bench_replay(telnet_util, args):
+  telnetlib = sys.modules[MODULE_UTILS + '.telnetlib']
+  header, events = telnetlib.read_transcript(args.transcript)
+  meta = header.get('meta') or {}
+  received = sum(len(value) for _, op, value in events if op == 'recv')
+  params = {
+    'network_os': meta.get('network_os') or args.network_os,
+    'commands': meta.get('commands'),
+    'user': 'cisco',
+    'password': 'cisco',
+    'become': meta.get('become', True),
+    'become_pass': 'cisco',
+    'command_timeout': 60,
+    'replay_path': args.transcript,
+    'replay_realtime': args.realtime
+  }
+
+  profile = cProfile.Profile() if args.profile else None
+  elapsed = list()
+  with Usage() as usage:
+    for _ in range(args.repeat):
+      tc = telnet_util.TelnetClient(params)
+      start = time.perf_counter()
+      if profile:
+        profile.enable()
+      result = tc.process_command()
+      if profile:
+        profile.disable()
+      elapsed.append(time.perf_counter() - start)
+      assert not result.get('failed'), result.get('msg')
+
+  print('replay: {0}, {1} commands, {2} bytes recorded in {3:.3f} sec, {4}'.format(
+    args.transcript, len(meta.get('commands') or []), received,
+    events[-1][0] if events else 0, 'realtime' if args.realtime else 'as fast as possible'))
+  print('  {0} times, mean {1:.3f} sec, min {2:.3f} sec, {3:.1f} MB/s'.format(
+    args.repeat, sum(elapsed) / len(elapsed), min(elapsed), received / min(elapsed) / 1e6))
+  print('  ' + usage.report())
+  if profile:
+    pstats.Stats(profile).sort_stats('cumulative').print_stats(args.profile)
+
+
+def run_all(telnet_util, args):
+  args.count = 20
+  bench_login(telnet_util, args)
+  args.count = 100
+  args.pipeline = 0
+  bench_commands(telnet_util, args)
+  args.pipeline = 8
+  bench_commands(telnet_util, args)
+  args.sizes = [1, 8]
+  args.recv_size = args.recv_size_max = args.rcvbuf = None
+  bench_throughput(telnet_util, args)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='benchmark TelnetClient against the fake device')
+  parser.add_argument('--network-os', default='ios', choices=['ios', 'fujitsu_sir', 'fujitsu_srs'])
+  parser.add_argument('--latency', type=float, default=0, help='seconds the fake device delays the data from the client')
+  parser.add_argument('--iac-noise', type=int, default=0, help='telnet commands every N lines of the output')
+  subparsers = parser.add_subparsers(dest='bench')
+
+  p = subparsers.add_parser('login', help='login latency')
+  p.add_argument('--count', type=int, default=20)
+  p.set_defaults(func=bench_login)
+
+  p = subparsers.add_parser('commands', help='commands per second in one session')
+  p.add_argument('--count', type=int, default=100)
+  p.add_argument('--pipeline', type=int, default=0, help='pipeline window, 0 to disable')
+  p.set_defaults(func=bench_commands)
+
+  p = subparsers.add_parser('throughput', help='MB/s of large output')
+  p.add_argument('--sizes', type=float, nargs='+', default=[1, 8, 32], help='output sizes in MB')
+  p.add_argument('--recv-size', type=int, default=None, help='initial recv() size')
+  p.add_argument('--recv-size-max', type=int, default=None, help='upper limit of recv() size, the same as --recv-size to fix it')
+  p.add_argument('--rcvbuf', type=int, default=None, help='SO_RCVBUF of the socket')
+  p.set_defaults(func=bench_throughput)
+
+  p = subparsers.add_parser('record', help='record a session with the fake device to a transcript')
+  p.add_argument('--transcript', required=True, help='path of the transcript, .gz to compress')
+  p.add_argument('--count', type=int, default=20, help='number of show version before show tech-support')
+  p.add_argument('--tech-size', type=float, default=1, help='output size of show tech-support in MB')
+  p.set_defaults(func=bench_record)
+
+  p = subparsers.add_parser('replay', help='run TelnetClient over a transcript without network')
+  p.add_argument('--transcript', required=True, help='path of the transcript')
+  p.add_argument('--repeat', type=int, default=3)
+  p.add_argument('--realtime', action='store_true', help='delay the data as recorded')
+  p.add_argument('--profile', type=int, nargs='?', const=25, default=0, help='show top N functions of cProfile')
+  p.set_defaults(func=bench_replay)
+
+  p = subparsers.add_parser('all', help='run all benchmarks with small sizes')
+  p.set_defaults(func=run_all)
+
+  args = parser.parse_args()
+  if not getattr(args, 'func', None):
+    parser.print_help()
+    return 1
+  args.func(load_telnet_util(), args)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring, broad-except
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+"""Microbenchmarks for the bundled telnetlib (plugins/module_utils/telnetlib.py)
+
+No network is used, data is fed straight into the Telnet queues.
+
+  python tools/bench_telnetlib.py rawq --size 8
+  python tools/bench_telnetlib.py rawq --size 1 --baseline
+  python tools/bench_telnetlib.py expect --sizes 1 2 4 8
+  python tools/bench_telnetlib.py expect --sizes 0.25 0.5 1 --full
+  python tools/bench_telnetlib.py alternation --sizes 1 2 4
+  python tools/bench_telnetlib.py selector --count 20000
+  python tools/bench_telnetlib.py fill --size 32
+"""
+
+import argparse
+import importlib.util
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TELNETLIB_PATH = os.path.join(HERE, '..', 'plugins', 'module_utils', 'telnetlib.py')
+
+# recv() size used by Telnet.fill_rawq()
+CHUNK_SIZE = 15000
+
+# command prompt regex used by TelnetClient
+COMMAND_PROMPT = re.compile(br"[\r\n]?[\w\+\-\.:\/\[\]]+(?:\([^\)]+\)){0,3}(?:[>#]) ?$")
+
+# prompts TelnetClient waits for together on the console, the command prompt matches
+LOGIN_PROMPTS = [
+  re.compile(br"[Ll]ogin: ?|[Uu]sername: ?"),
+  re.compile(br"[\r\n](?:Local_)?[Pp]assword: ?$"),
+  COMMAND_PROMPT
+]
+
+
+def load_bundled_telnetlib():
+  """load plugins/module_utils/telnetlib.py without ansible"""
+  spec = importlib.util.spec_from_file_location('bundled_telnetlib', TELNETLIB_PATH)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+def load_stdlib_telnetlib():
+  """load telnetlib in the standard library (removed in python 3.13)"""
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    try:
+      import telnetlib
+      return telnetlib
+    except ImportError:
+      return None
+
+
+class NullSocket(object):
+  """stands in for the socket, swallow option negotiation replies"""
+
+  def sendall(self, _data):
+    pass
+
+  def close(self):
+    pass
+
+
+def make_capture(size, iac=False):
+  """generate show tech-support like output of size bytes
+
+  if iac is True, IAC negotiation and escaped 0xff bytes are embedded every few lines
+  """
+  line = b'GigabitEthernet0/0/1 is up, line protocol is up  Hardware is ISR4331-3x1GE\r\n'
+  negotiation = b'\xff\xfb\x01\xff\xfb\x03\xff\xfd\x18\xff\xfa\x18\x01\xff\xf0\xff\xff'
+  lines = []
+  total = 0
+  n = 0
+  while total < size:
+    if iac and n % 8 == 0:
+      lines.append(negotiation)
+      total += len(negotiation)
+    lines.append(line)
+    total += len(line)
+    n += 1
+  return b''.join(lines)
+
+
+def bench_rawq(telnetlib, capture, chunk_size=CHUNK_SIZE):
+  """feed capture into process_rawq() in recv() sized chunks, return (seconds, cooked bytes)"""
+  tn = telnetlib.Telnet()
+  tn.sock = NullSocket()
+  cooked = 0
+  start = time.perf_counter()
+  for i in range(0, len(capture), chunk_size):
+    tn.rawq = capture[i:i+chunk_size]
+    tn.irawq = 0
+    tn.process_rawq()
+    cooked += len(tn.read_very_lazy())
+  elapsed = time.perf_counter() - start
+  tn.sock = None
+  return elapsed, cooked
+
+
+def bench_expect(telnetlib, capture, window=None, prompts=None, method='expect'):
+  """stream capture followed by a prompt through a socketpair, return seconds spent in expect()"""
+  prompts = prompts or [COMMAND_PROMPT]
+  sock, peer = socket.socketpair()
+
+  def feed():
+    for i in range(0, len(capture), CHUNK_SIZE):
+      peer.sendall(capture[i:i+CHUNK_SIZE])
+    peer.sendall(b'\r\nrouter#')
+
+  writer = threading.Thread(target=feed)
+  writer.daemon = True
+
+  tn = telnetlib.Telnet()
+  tn.sock = sock
+  writer.start()
+  start = time.perf_counter()
+  if window is None:
+    index, _, text = getattr(tn, method)(prompts)
+  else:
+    index, _, text = getattr(tn, method)(prompts, window=window)
+  elapsed = time.perf_counter() - start
+  writer.join()
+  tn.close()
+  peer.close()
+  assert index == len(prompts) - 1 and text.endswith(b'router#')
+  return elapsed
+
+
+def report(name, size, elapsed):
+  print('  {0:<24} {1:>9.3f} sec {2:>10.1f} MB/s'.format(name, elapsed, size / elapsed / 1e6 if elapsed else 0))
+
+
+def run_rawq(args):
+  size = int(args.size * 1024 * 1024)
+  impls = [('bundled', load_bundled_telnetlib())]
+  if args.baseline:
+    stdlib = load_stdlib_telnetlib()
+    if stdlib is None:
+      print('stdlib telnetlib is not available, baseline skipped')
+    else:
+      impls.append(('stdlib (per byte)', stdlib))
+
+  for iac in (False, True):
+    capture = make_capture(size, iac=iac)
+    print('process_rawq: {0} bytes, {1} IAC negotiation'.format(len(capture), 'with' if iac else 'without'))
+    for name, telnetlib in impls:
+      elapsed, _ = bench_rawq(telnetlib, capture)
+      report(name, len(capture), elapsed)
+
+
+def run_expect(args):
+  telnetlib = load_bundled_telnetlib()
+  window = telnetlib.expect_window([COMMAND_PROMPT])
+  modes = [('incremental', window)]
+  if args.full:
+    modes.append(('full rescan', None))
+
+  print('expect: command prompt after N MB of output, window {0} bytes'.format(window))
+  print('  {0:<12} {1:>8} {2:>10} {3:>10}'.format('mode', 'MB', 'sec', 'ns/byte'))
+  for name, w in modes:
+    for size in args.sizes:
+      capture = make_capture(int(size * 1024 * 1024))
+      elapsed = bench_expect(telnetlib, capture, window=w)
+      print('  {0:<12} {1:>8} {2:>10.3f} {3:>10.1f}'.format(name, size, elapsed, elapsed / len(capture) * 1e9))
+
+
+def run_alternation(args):
+  telnetlib = load_bundled_telnetlib()
+  window = telnetlib.expect_window(LOGIN_PROMPTS)
+
+  print('alternation: login, password and command prompts after N MB of output, window {0} bytes'.format(window))
+  print('  {0:<12} {1:>8} {2:>10} {3:>10}'.format('method', 'MB', 'sec', 'ns/byte'))
+  for method in ('expect', 'expect_any'):
+    for size in args.sizes:
+      capture = make_capture(int(size * 1024 * 1024))
+      elapsed = bench_expect(telnetlib, capture, window=window, prompts=LOGIN_PROMPTS, method=method)
+      print('  {0:<12} {1:>8} {2:>10.3f} {3:>10.1f}'.format(method, size, elapsed, elapsed / len(capture) * 1e9))
+
+
+def per_call_selector(telnetlib):
+  """Telnet which builds and registers a new selector on every read call, as before"""
+
+  class PerCallSelectorTelnet(telnetlib.Telnet):
+
+    def __init__(self, *args, **kwargs):
+      # set before Telnet.__init__(), which may open the connection
+      self.selector = None
+      super(PerCallSelectorTelnet, self).__init__(*args, **kwargs)
+
+
+    def get_selector(self):
+      if self.selector is not None:
+        self.selector.close()
+        self.selector = None
+      return super(PerCallSelectorTelnet, self).get_selector()
+
+  return PerCallSelectorTelnet
+
+
+def bench_round_trips(telnet_class, count):
+  """send short commands to an echo peer and expect the prompt with timeout, return seconds"""
+  sock, peer = socket.socketpair()
+
+  def respond():
+    f = peer.makefile('rb')
+    for _ in range(count):
+      f.readline()
+      peer.sendall(b'show clock\r\n*12:00:00.000 UTC Mon Jan 1 2019\r\nrouter#')
+    f.close()
+
+  responder = threading.Thread(target=respond)
+  responder.daemon = True
+  responder.start()
+
+  tn = telnet_class()
+  tn.sock = sock
+  window = 1024
+  start = time.perf_counter()
+  for _ in range(count):
+    tn.write(b'show clock\n')
+    index, _, _ = tn.expect([COMMAND_PROMPT], 5, window=window)
+    assert index == 0
+    while tn.sock_avail():
+      tn.read_very_eager()
+  elapsed = time.perf_counter() - start
+  responder.join()
+  tn.close()
+  peer.close()
+  return elapsed
+
+
+def bench_sock_avail(telnet_class, count):
+  """call sock_avail() on an idle connection, return seconds"""
+  sock, peer = socket.socketpair()
+  tn = telnet_class()
+  tn.sock = sock
+  start = time.perf_counter()
+  for _ in range(count):
+    tn.sock_avail()
+  elapsed = time.perf_counter() - start
+  tn.close()
+  peer.close()
+  return elapsed
+
+
+def run_selector(args):
+  telnetlib = load_bundled_telnetlib()
+  impls = [('per call', per_call_selector(telnetlib)), ('long-lived', telnetlib.Telnet)]
+
+  print('selector: {0} calls, {1}'.format(args.count, telnetlib._TelnetSelector.__name__))
+  print('  {0:<12} {1:<14} {2:>10} {3:>12}'.format('selector', 'bench', 'sec', 'us/call'))
+  for name, telnet_class in impls:
+    elapsed = bench_sock_avail(telnet_class, args.count)
+    print('  {0:<12} {1:<14} {2:>10.3f} {3:>12.2f}'.format(name, 'sock_avail', elapsed, elapsed / args.count * 1e6))
+    elapsed = bench_round_trips(telnet_class, args.count)
+    print('  {0:<12} {1:<14} {2:>10.3f} {3:>12.2f}'.format(name, 'round trip', elapsed, elapsed / args.count * 1e6))
+
+
+def raw_path(telnetlib):
+  """Telnet which always goes through the raw queue and process_rawq(), as before"""
+
+  class RawTelnet(telnetlib.Telnet):
+
+    def fill_rawq(self, raw=False):
+      super(RawTelnet, self).fill_rawq(raw=True)
+
+  return RawTelnet
+
+
+def bench_fill(telnet_class, capture):
+  """receive capture through a socketpair with fill_rawq() and process_rawq(), return seconds"""
+  sock, peer = socket.socketpair()
+
+  def feed():
+    peer.sendall(capture)
+    peer.shutdown(socket.SHUT_WR)
+
+  writer = threading.Thread(target=feed)
+  writer.daemon = True
+
+  tn = telnet_class()
+  tn.sock = sock
+  # nobody reads the replies to the option negotiation
+  tn.set_option_negotiation_callback(lambda *_: None)
+  writer.start()
+  cooked = 0
+  start = time.perf_counter()
+  while not tn.eof:
+    tn.fill_rawq()
+    tn.process_rawq()
+    try:
+      cooked += len(tn.read_very_lazy())
+    except EOFError:
+      break
+  elapsed = time.perf_counter() - start
+  writer.join()
+  tn.close()
+  peer.close()
+  return elapsed, cooked
+
+
+def run_fill(args):
+  telnetlib = load_bundled_telnetlib()
+  size = int(args.size * 1024 * 1024)
+  impls = [('raw queue', raw_path(telnetlib)), ('direct', telnetlib.Telnet)]
+
+  for iac in (False, True):
+    capture = make_capture(size, iac=iac)
+    print('fill_rawq: {0} bytes through a socketpair, {1} IAC negotiation'.format(len(capture), 'with' if iac else 'without'))
+    results = set()
+    for name, telnet_class in impls:
+      elapsed, cooked = bench_fill(telnet_class, capture)
+      results.add(cooked)
+      report(name, len(capture), elapsed)
+    assert len(results) == 1
+
+
+def main():
+  parser = argparse.ArgumentParser(description='benchmark bundled telnetlib')
+  subparsers = parser.add_subparsers(dest='bench')
+
+  p = subparsers.add_parser('rawq', help='IAC decoder in process_rawq()')
+  p.add_argument('--size', type=float, default=8, help='capture size in MB (default 8)')
+  p.add_argument('--baseline', action='store_true', help='compare with stdlib telnetlib, keep --size small')
+  p.set_defaults(func=run_rawq)
+
+  p = subparsers.add_parser('expect', help='prompt search in expect()')
+  p.add_argument('--sizes', type=float, nargs='+', default=[1, 2, 4, 8], help='output sizes in MB')
+  p.add_argument('--full', action='store_true', help='compare with full rescan, it is quadratic, keep --sizes small')
+  p.set_defaults(func=run_expect)
+
+  p = subparsers.add_parser('alternation', help='expect() with a list of prompts vs expect_any() with the combined regex')
+  p.add_argument('--sizes', type=float, nargs='+', default=[1, 2, 4], help='output sizes in MB')
+  p.set_defaults(func=run_alternation)
+
+  p = subparsers.add_parser('selector', help='selector built per read call vs one per connection')
+  p.add_argument('--count', type=int, default=20000)
+  p.set_defaults(func=run_selector)
+
+  p = subparsers.add_parser('fill', help='receive path of fill_rawq(), raw queue vs straight to the cooked queue')
+  p.add_argument('--size', type=float, default=32, help='capture size in MB (default 32)')
+  p.set_defaults(func=run_fill)
+
+  args = parser.parse_args()
+  if not getattr(args, 'func', None):
+    parser.print_help()
+    return 1
+  args.func(args)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring, broad-except
+
+# (c) 2019, Takamitsu IIDA (@takamitsu-iida)
+
+"""Fake network device over telnet for offline testing
+
+It emulates login, privilege escalation, paging and command prompts of
+cisco ios and fujitsu sir/srs.
+
+  python tools/fake_device.py --port 2323
+  python tools/fake_device.py --port 2323 --network-os fujitsu_sir --latency 0.05 --iac-noise 8
+
+  # in another terminal
+  telnet localhost 2323   (user cisco, password cisco, enable password cisco)
+
+It can also be started in a background thread of the test script.
+
+  server = FakeDeviceServer(port=0).start()
+  params['host'], params['port'] = server.host, server.port
+  ...
+  server.stop()
+
+Options (keyword arguments of FakeDeviceServer, --options of the command line)
+  network_os   ios, fujitsu_sir or fujitsu_srs
+  tech_size    bytes of show tech-support output
+  latency      seconds to delay the data from the client, emulates the round trip time
+  iac_noise    insert telnet commands every N lines of the output, 0 to disable
+  page_lines   lines of a page until the pager is disabled
+  console      wait for the return key before login like a console port
+"""
+
+import argparse
+import asyncio
+import sys
+import threading
+
+# telnet protocol characters
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+NOP = 241
+SE = 240
+
+ECHO = 1
+SGA = 3
+TTYPE = 24
+
+# telnet commands inserted by iac_noise, the client must drop them from the output
+IAC_NOISE = bytes([IAC, NOP, IAC, DO, TTYPE])
+
+SHOW_TECH_LINE = 'GigabitEthernet0/0/1 is up, line protocol is up  Hardware is ISR4331-3x1GE\n'
+
+PROFILES = {
+  'ios': {
+    'banner': '\nUser Access Verification\n\n',
+    'login_prompt': 'Username: ',
+    'password_prompt': 'Password: ',
+    'login_failed': '% Login invalid\n\n',
+    'user_prompt': '{hostname}>',
+    'privileged_prompt': '{hostname}#',
+    'become': 'enable',
+    'become_failed': '% Access denied\n\n',
+    'pager_disable': 'terminal length 0',
+    'more': ' --More-- ',
+    'logout': ('quit', 'exit', 'logout'),
+    'invalid_input': '{caret}^\n% Invalid input detected at \'^\' marker.\n\n',
+    'show_version': '''Cisco IOS XE Software, Version 16.09.03
+Cisco IOS Software [Fuji], Virtual XE Software (X86_64_LINUX_IOSD-UNIVERSALK9-M), Version 16.9.3, RELEASE SOFTWARE (fc2)
+
+{hostname} uptime is 1 day, 2 hours, 3 minutes
+System image file is "bootflash:packages.conf"
+''',
+    'show_ip_int_brief': '''Interface              IP-Address      OK? Method Status                Protocol
+GigabitEthernet1       192.168.122.179 YES DHCP   up                    up
+GigabitEthernet2       unassigned      YES NVRAM  administratively down down
+GigabitEthernet3       unassigned      YES NVRAM  administratively down down
+''',
+  },
+  'fujitsu_sir': {
+    'banner': '\n',
+    'login_prompt': 'login: ',
+    'password_prompt': 'Password: ',
+    'login_failed': 'Login incorrect\n\n',
+    'user_prompt': '{hostname}> ',
+    'privileged_prompt': '{hostname}# ',
+    'become': 'admin',
+    'become_failed': '<ERROR> password is incorrect\n',
+    'pager_disable': 'terminal pager disable',
+    'more': '--More--',
+    'logout': ('exit', 'logout', 'quit'),
+    'invalid_input': '<ERROR> invalid command\n',
+    'show_version': '''Si-R G200 V20.52 NY0001 Mon Jan 20 12:00:00 JST 2019
+Copyright (C) 2019 FUJITSU LIMITED
+{hostname} uptime is 1 day, 2:03:00
+''',
+    'show_ip_int_brief': '''lan0      192.168.1.1/24        up
+lan1      10.0.0.1/30           up
+lan2      unassigned            down
+''',
+  },
+}
+PROFILES['fujitsu_srs'] = dict(PROFILES['fujitsu_sir'], show_version='''SR-S 324TC1 V13.12 NY0001 Mon Jan 20 12:00:00 JST 2019
+Copyright (C) 2019 FUJITSU LIMITED
+{hostname} uptime is 1 day, 2:03:00
+''')
+
+
+class FakeDevice(object):
+  """one telnet session of the fake device"""
+
+  def __init__(self, reader, writer, config):
+    self.reader = reader
+    self.writer = writer
+    self.config = config
+    self.profile = PROFILES[config.get('network_os', 'ios')]
+    self.hostname = config.get('hostname', 'router')
+    self.enabled = False
+    self.paging = True
+    self._buf = b''
+
+  #
+  # I/O
+  #
+
+  def send(self, text):
+    data = text.replace('\n', '\r\n').encode('utf-8') if isinstance(text, str) else text
+    self.writer.write(data)
+
+
+  async def recv(self):
+    """receive data from the client, delayed by latency to emulate the round trip time"""
+    data = await self.reader.read(4096)
+    latency = self.config.get('latency')
+    if latency and data:
+      await asyncio.sleep(latency)
+    return data
+
+
+  async def read_byte(self):
+    """read one byte of user data, skipping telnet commands"""
+    while True:
+      if not self._buf:
+        self._buf = await self.recv()
+        if not self._buf:
+          raise EOFError
+      c = self._buf[0]
+      if c != IAC:
+        self._buf = self._buf[1:]
+        return c
+      # IAC sequence, wait until it is complete
+      if len(self._buf) < 2:
+        self._buf += await self.recv()
+        continue
+      cmd = self._buf[1]
+      if cmd in (DO, DONT, WILL, WONT):
+        if len(self._buf) < 3:
+          self._buf += await self.recv()
+          continue
+        self._buf = self._buf[3:]
+      elif cmd == SB:
+        i = self._buf.find(bytes([IAC, SE]))
+        if i < 0:
+          self._buf += await self.recv()
+          continue
+        self._buf = self._buf[i+2:]
+      elif cmd == IAC:
+        self._buf = self._buf[2:]
+        return IAC
+      else:
+        self._buf = self._buf[2:]
+
+
+  async def read_line(self, echo=True):
+    """read one line, echo it back if echo is True"""
+    line = bytearray()
+    while True:
+      c = await self.read_byte()
+      if c in (0x0d, 0x0a):
+        # \r\n, \r\0 are one line end
+        if c == 0x0d and self._buf[:1] in (b'\n', b'\0'):
+          self._buf = self._buf[1:]
+        self.send('\n')
+        await self.writer.drain()
+        return line.decode('utf-8', errors='replace')
+      line.append(c)
+      if echo:
+        self.writer.write(bytes([c]))
+
+
+  async def read_char(self):
+    c = await self.read_byte()
+    return chr(c)
+
+
+  async def send_output(self, text):
+    """send the output of a command, paged if the pager is enabled"""
+    lines = text.replace('\n', '\r\n').encode('utf-8').splitlines(True)
+    await self.send_lines(lines)
+
+
+  async def send_lines(self, lines):
+    noise = self.config.get('iac_noise', 0)
+    page_lines = self.config.get('page_lines', 24)
+    for i, line in enumerate(lines):
+      if noise and i % noise == 0:
+        self.writer.write(IAC_NOISE)
+      self.writer.write(line)
+      if self.paging and (i + 1) % page_lines == 0 and i + 1 < len(lines):
+        if not await self.more():
+          return
+    await self.writer.drain()
+
+
+  async def more(self):
+    """show the pager prompt and wait for a key, return False to quit"""
+    self.send(self.profile['more'])
+    await self.writer.drain()
+    c = await self.read_char()
+    # erase the pager prompt
+    self.send('\r' + ' ' * len(self.profile['more']) + '\r')
+    return c not in ('q', 'Q')
+
+  #
+  # session
+  #
+
+  def prompt(self):
+    prompt = self.profile['privileged_prompt' if self.enabled else 'user_prompt']
+    return prompt.format(hostname=self.hostname)
+
+
+  async def login(self):
+    self.send(bytes([IAC, WILL, ECHO, IAC, WILL, SGA, IAC, DO, SGA]))
+    if self.config.get('console'):
+      # console port is silent until the return key is pressed
+      await self.writer.drain()
+      await self.read_line(echo=False)
+    self.send(self.profile['banner'])
+    for _ in range(3):
+      self.send(self.profile['login_prompt'])
+      await self.writer.drain()
+      user = await self.read_line()
+      self.send(self.profile['password_prompt'])
+      await self.writer.drain()
+      password = await self.read_line(echo=False)
+      if user == self.config.get('user') and password == self.config.get('password'):
+        return True
+      self.send(self.profile['login_failed'])
+    return False
+
+
+  async def run(self):
+    try:
+      if not await self.login():
+        return
+      while True:
+        self.send(self.prompt())
+        await self.writer.drain()
+        line = await self.read_line()
+        if not await self.execute(line.strip()):
+          return
+    except (EOFError, ConnectionError):
+      pass
+    finally:
+      self.writer.close()
+
+
+  async def execute(self, command):
+    """execute one command, return False to close the session"""
+    if not command:
+      return True
+
+    if command in self.profile['logout']:
+      return False
+
+    if command == self.profile['pager_disable']:
+      self.paging = False
+      return True
+
+    if command.startswith('terminal '):
+      return True
+
+    if command == self.profile['become']:
+      self.send(self.profile['password_prompt'])
+      await self.writer.drain()
+      password = await self.read_line(echo=False)
+      if password == self.config.get('enable_password'):
+        self.enabled = True
+      else:
+        self.send(self.profile['become_failed'])
+      return True
+
+    if command == 'disable':
+      self.enabled = False
+      return True
+
+    if command.startswith('clear counters'):
+      if not self.enabled:
+        return self.invalid_input(command)
+      self.send('Clear "show interface" counters on all interfaces [confirm]')
+      await self.writer.drain()
+      answer = await self.read_char()
+      self.send('\n')
+      if answer in ('y', 'Y', '\r', '\n'):
+        self.send('%s: %%CLEAR-5-COUNTERS: Clear counter on all interfaces\n' % self.hostname)
+      return True
+
+    if command.startswith('show ver'):
+      await self.send_output(self.profile['show_version'].format(hostname=self.hostname))
+      return True
+
+    if command.startswith('show ip int'):
+      await self.send_output(self.profile['show_ip_int_brief'])
+      return True
+
+    if command.startswith('show tech'):
+      await self.send_bulk(self.config.get('tech_size', 1024 * 1024))
+      return True
+
+    return self.invalid_input(command)
+
+
+  def invalid_input(self, _command):
+    self.send(self.profile['invalid_input'].format(caret=' ' * len(self.prompt())))
+    return True
+
+
+  async def send_bulk(self, size):
+    line = SHOW_TECH_LINE.replace('\n', '\r\n').encode('utf-8')
+    if self.paging:
+      await self.send_lines([line] * max(1, size // len(line)))
+      self.send('\n')
+      return
+
+    noise = self.config.get('iac_noise', 0)
+    if noise:
+      block = IAC_NOISE + line * noise
+    else:
+      block = line
+    chunk = block * max(1, 65536 // len(block))
+    sent = 0
+    while sent < size:
+      data = chunk[:size - sent]
+      self.writer.write(data)
+      sent += len(data)
+      await self.writer.drain()
+    self.send('\n')
+
+
+class FakeDeviceServer(object):
+  """asyncio telnet server running FakeDevice sessions"""
+
+  def __init__(self, host='127.0.0.1', port=2323, **config):
+    self.host = host
+    self.port = port
+    self.config = {
+      'network_os': 'ios',
+      'hostname': 'router',
+      'user': 'cisco',
+      'password': 'cisco',
+      'enable_password': 'cisco'
+    }
+    self.config.update(config)
+    self.loop = None
+    self.server = None
+    self._thread = None
+
+
+  async def handle(self, reader, writer):
+    try:
+      await FakeDevice(reader, writer, self.config).run()
+    except asyncio.CancelledError:
+      # session closed by stop()
+      pass
+
+
+  async def serve(self):
+    self.server = await asyncio.start_server(self.handle, self.host, self.port)
+    self.port = self.server.sockets[0].getsockname()[1]
+
+
+  def start(self):
+    """start the server in a background thread, port 0 picks a free port"""
+    self.loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+      asyncio.set_event_loop(self.loop)
+      self.loop.run_until_complete(self.serve())
+      ready.set()
+      self.loop.run_forever()
+
+    self._thread = threading.Thread(target=run)
+    self._thread.daemon = True
+    self._thread.start()
+    ready.wait()
+    return self
+
+
+  def stop(self):
+    """stop the server started by start() and close the sessions"""
+    async def shutdown():
+      self.server.close()
+      tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+      for task in tasks:
+        task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self._thread.join()
+    self.loop.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(description='fake network device over telnet')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=2323, help='0 picks a free port')
+  parser.add_argument('--network-os', default='ios', choices=sorted(PROFILES))
+  parser.add_argument('--hostname', default='router')
+  parser.add_argument('--user', default='cisco')
+  parser.add_argument('--password', default='cisco')
+  parser.add_argument('--enable-password', default='cisco')
+  parser.add_argument('--tech-size', type=int, default=1024 * 1024, help='bytes of show tech-support output')
+  parser.add_argument('--latency', type=float, default=0, help='seconds to delay the data from the client')
+  parser.add_argument('--iac-noise', type=int, default=0, help='insert telnet commands every N lines of the output')
+  parser.add_argument('--page-lines', type=int, default=24, help='lines of a page until the pager is disabled')
+  parser.add_argument('--console', action='store_true', help='wait for the return key before login like a console port')
+  args = parser.parse_args()
+
+  fake = FakeDeviceServer(
+    host=args.host, port=args.port, network_os=args.network_os, hostname=args.hostname,
+    user=args.user, password=args.password, enable_password=args.enable_password,
+    tech_size=args.tech_size, latency=args.latency, iac_noise=args.iac_noise,
+    page_lines=args.page_lines, console=args.console)
+
+  async def serve_forever():
+    await fake.serve()
+    print('fake device listening on {0}:{1}'.format(fake.host, fake.port), flush=True)
+    await fake.server.serve_forever()
+
+  try:
+    asyncio.run(serve_forever())
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())